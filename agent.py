@@ -1,45 +1,37 @@
 #!/usr/bin/env python3
 import json
 import logging
+import threading
+import time
+from functools import partial
 
 from colorama import Fore, init
 from dotenv import load_dotenv
-from openai import OpenAI
 
-from settings import CHAT_MODEL, OPENAI_API_KEY
-from tools.registry import ToolRegistry
-from tools.semantic_search import semantic_search_tool
+from clients import get_openai_client
+from conversation import ConversationContext
+from settings import CHAT_MODEL, STREAM_RESPONSES
+from timing import get_stage_timer, span
+from tools.registry import Lazy, ToolRegistry
 
 load_dotenv()
 # logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("TorobGPT")
 
 
-def main():
-    init(autoreset=True)
-
-    client = OpenAI(api_key=OPENAI_API_KEY)
+# Prepare system message with tool instructions
+# ## PERSISTENCE
+# You are an agent - please keep going until the user's query is completely
+# resolved, before ending your turn and yielding back to the user. Only
+# terminate your turn when you are sure that the problem is solved.
 
-    # Setup tool registry
-    registry = ToolRegistry()
-    # registry.register(read_file)
-    registry.register(semantic_search_tool)
-
-    # Prepare system message with tool instructions
-    # ## PERSISTENCE
-    # You are an agent - please keep going until the user's query is completely
-    # resolved, before ending your turn and yielding back to the user. Only
-    # terminate your turn when you are sure that the problem is solved.
-
-    # ## TOOL CALLING
-    # If you are not sure about file content or codebase structure pertaining to
-    # the user's request, use your tools to read files and gather the relevant
-    # information: do NOT guess or make up an answer.
-
-    messages = [
-        {
-            "role": "developer",
-            "content": """
+# ## TOOL CALLING
+# If you are not sure about file content or codebase structure pertaining to
+# the user's request, use your tools to read files and gather the relevant
+# information: do NOT guess or make up an answer.
+DEVELOPER_MESSAGE = {
+    "role": "developer",
+    "content": """
 # Identity
 
 You are a helpful assistant that helps users by chatting with them
@@ -54,7 +46,10 @@ you could use your tools to search for hafez poems and verses.
 
 # Tools
 do not ask user to use tools, if you think you can give better answer using tools just use them.
-you have tool to search for hafez poems and verses. if the query is complex use between 2 and 5 tool calls.
+you have tool to search for hafez poems and verses. if the query is complex pass between 2 and 5 queries
+in a single tool call instead of making several tool calls.
+for questions about whole ghazals (which poem is about a theme) use the poem search tool, which returns
+poems grouped with their best beyts.
 
 ## PERSISTENCE
 You are an agent - please keep going until the user's query is completely 
@@ -72,51 +67,171 @@ extensively on the outcomes of the previous function calls. DO NOT do this
 entire process by making function calls only, as this can impair your 
 ability to solve the problem and think insightfully.
 """,
-        }
+}
+
+
+def blocking_turn(client, registry, messages):
+    """
+    Runs one model turn without streaming.
+    Returns (reply_text, [(tool_call, tool_output), ...]); tool calls of the turn run concurrently.
+    """
+    response = client.responses.create(
+        model=CHAT_MODEL,
+        input=messages,
+        tools=registry.get_tools(),
+    )
+    tool_calls = [item for item in response.output if item.type == "function_call"]
+    calls = []
+    for tool_call in tool_calls:
+        tool_arg = json.loads(tool_call.arguments)
+        print(f"  {Fore.GREEN}Invoking tool {tool_call.name} with arg {tool_arg}{Fore.RESET}")
+        calls.append((tool_call.name, tool_arg))
+    tool_outputs = registry.run_many(calls)
+    reply = response.output_text
+    if reply:
+        print(f"{Fore.YELLOW}TorobGPT:{Fore.RESET} {reply}")
+    return reply, list(zip(tool_calls, tool_outputs, strict=True))
+
+
+def streaming_turn(client, registry, messages):
+    """
+    Runs one model turn with streaming: text deltas are printed as they arrive and function-call
+    arguments are assembled from their deltas. Each tool call is dispatched as soon as its arguments
+    are complete, while the rest of the response is still streaming.
+    Returns (reply_text, [(tool_call, tool_output), ...]) like blocking_turn.
+    """
+    started = time.monotonic()
+    first_token_at = None
+    reply_parts = []
+    mid_line = False  # a streamed text line is still open on the terminal
+    pending = {}  # item_id -> {"name", "call_id", "arguments": [deltas]}
+    dispatched = []  # (item_id, name, future, dispatch time)
+    response = None
+
+    stream = client.responses.create(
+        model=CHAT_MODEL,
+        input=messages,
+        tools=registry.get_tools(),
+        stream=True,
+    )
+    for event in stream:
+        if first_token_at is None and event.type in (
+            "response.output_text.delta",
+            "response.function_call_arguments.delta",
+        ):
+            first_token_at = time.monotonic()
+            logger.info(f"time to first token: {first_token_at - started:.3f}s")
+        match event.type:
+            case "response.output_text.delta":
+                if not reply_parts:
+                    print(f"{Fore.YELLOW}TorobGPT:{Fore.RESET} ", end="")
+                reply_parts.append(event.delta)
+                print(event.delta, end="", flush=True)
+                mid_line = True
+            case "response.output_item.added" if event.item.type == "function_call":
+                pending[event.item.id] = {
+                    "name": event.item.name,
+                    "call_id": event.item.call_id,
+                    "arguments": [],
+                }
+            case "response.function_call_arguments.delta":
+                pending[event.item_id]["arguments"].append(event.delta)
+            case "response.function_call_arguments.done":
+                call = pending[event.item_id]
+                tool_arg = json.loads(event.arguments or "".join(call["arguments"]))
+                if mid_line:
+                    print()
+                    mid_line = False
+                print(f"  {Fore.GREEN}Invoking tool {call['name']} with arg {tool_arg}{Fore.RESET}")
+                future = registry.submit(call["name"], tool_arg)
+                dispatched.append((event.item_id, call["name"], future, time.monotonic()))
+            case "response.completed":
+                response = event.response
+            case "error":
+                raise RuntimeError(f"Streaming error: {event.message}")
+    if mid_line:
+        print()
+    if response is None:
+        raise RuntimeError("Response stream ended without a response.completed event")
+
+    tool_calls = {item.id: item for item in response.output if item.type == "function_call"}
+    tool_results = [
+        (tool_calls[item_id], registry.result(name, future, dispatched_at))
+        for item_id, name, future, dispatched_at in dispatched
     ]
+    logger.info(f"turn latency: {time.monotonic() - started:.3f}s ({len(tool_results)} tool calls)")
+    return "".join(reply_parts), tool_results
+
+
+def _search_index():
+    from tools.semantic_search import get_search_index
+
+    return get_search_index().warmup()
+
+
+def _poem_index():
+    # poem-level search always runs on sqlite-vec, which holds the poem centroids
+    from shards import get_sharded_index
+
+    return get_sharded_index("sqlite").warmup()
+
+
+def build_registry():
+    """
+    Registers the agent's tools by import path, with their shared indexes as Lazy dependencies:
+    neither the search stack nor the indexes are loaded until warmup or the first tool call.
+    """
+    registry = ToolRegistry()
+    # registry.register(read_file)
+    registry.register("tools.semantic_search:semantic_search_tool", index_instance=Lazy(_search_index))
+    registry.register("tools.semantic_search:poem_search_tool", index_instance=Lazy(_poem_index))
+    return registry
+
+
+def main():
+    init(autoreset=True)
+
+    registry = build_registry()
+
+    context = ConversationContext(DEVELOPER_MESSAGE)
 
     init_message = "Hello! I am TorobGPT. How can I assist you today? (type 'exit' or 'quit' to exit)"
-    messages.append({"role": "assistant", "content": init_message})
+    context.append({"role": "assistant", "content": init_message})
     print(f"{Fore.YELLOW}TorobGPT:{Fore.RESET} {init_message}")
+    # load the tools, set up the indexes and create the API client while the user types
+    registry.warmup(background=True)
+    threading.Thread(target=get_openai_client, name="client-warmup", daemon=True).start()
     read_user_input = True
     while True:
         if read_user_input:
             user_input = input(f"{Fore.BLUE}you:{Fore.RESET} ").strip()
             if user_input.lower() in ("exit", "quit"):
                 print(f"{Fore.YELLOW}TorobGPT:{Fore.RESET} Goodbye!")
+                logger.info(f"tool metrics: {json.dumps(registry.metrics())}")
+                logger.info(f"stage timings: {json.dumps(get_stage_timer().stats())}")
                 break
 
-            messages.append({"role": "user", "content": user_input})
+            # a turn that fails is undone back to here, so the next one doesn't follow a dangling user message
+            checkpoint = context.checkpoint()
+            context.append({"role": "user", "content": user_input})
 
+        turn = streaming_turn if STREAM_RESPONSES else blocking_turn
         try:
-            response = client.responses.create(
-                model=CHAT_MODEL,
-                input=messages,
-                tools=registry.get_tools(),
-            )
+            with span("turn"):
+                reply, tool_results = turn(get_openai_client(), registry, context.messages)
         except Exception as e:
             logger.error(f"Error during OpenAI API call: {e}")
-
-        match response.output[0].type:
-            case "function_call":
-                read_user_input = False
-                tool_call = response.output[0]
-                tool_arg = json.loads(tool_call.arguments)
-                tool_name = tool_call.name
-                print(f"  {Fore.GREEN}Invoking tool {tool_name} with arg {tool_arg}{Fore.RESET}")
-                tool_output = registry.run(tool_name, tool_arg)
-                messages.append(tool_call)
-                messages.append(
-                    {"type": "function_call_output", "call_id": tool_call.call_id, "output": str(tool_output)}
-                )
-            case "message":
-                read_user_input = True
-                reply = response.output_text
-                print(f"{Fore.YELLOW}TorobGPT:{Fore.RESET} {reply}")
-                messages.append({"role": "assistant", "content": reply})
-            case _:
-                logger.error(f"Unexpected response type: {response.output.type}")
-                reply = response.output_text
+            context.restore(checkpoint)
+            read_user_input = True
+            continue
+
+        if reply:
+            context.append({"role": "assistant", "content": reply})
+        # Outputs of every tool call of this turn go back to the model in one request
+        for tool_call, tool_output in tool_results:
+            context.add_tool_result(tool_call, tool_output, encoder=partial(registry.encode, tool_call.name))
+        logger.info(f"conversation size: ~{context.total_tokens} tokens in {len(context.messages)} messages")
+        read_user_input = not tool_results
 
 
 if __name__ == "__main__":
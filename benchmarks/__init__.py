@@ -0,0 +1 @@
+# offline benchmarks for llm-agent; run from the repo root, e.g. `python -m benchmarks.index_throughput`
@@ -0,0 +1,134 @@
+"""
+Recall and latency of the IVF approximate index against exact sqlite-vec search on
+synthetic clustered vectors. For every corpus size it builds an index, trains IVF and
+reports recall@k and p50/p99 latency per probe count, next to the exact scan.
+
+    uv run python -m benchmarks.ann_recall --sizes 100000 1000000 --dim 128 --probes 4 8 16 32
+
+Vectors default to 128 dimensions so a million of them fit comfortably on disk and in memory;
+pass --dim 1536 to match text-embedding-3-small.
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+import numpy as np
+
+from benchmarks.numpy_vs_sqlite import percentile, time_queries
+from settings import POEM_BASE_URL
+from sqlite_helper import Index
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_vectors(n, dim, clusters, noise, rng):
+    """Unit vectors drawn around random cluster centers, loosely mimicking the topical structure of verses."""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + noise * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top_k(matrix, queries, k, chunk=100_000):
+    """Ground-truth top-k row numbers by cosine similarity, scanning the matrix in chunks."""
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_ids = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(matrix), chunk):
+        scores = queries @ matrix[start : start + chunk].T
+        ids = np.arange(start, start + scores.shape[1])
+        best_scores = np.hstack([best_scores, scores])
+        best_ids = np.hstack([best_ids, np.broadcast_to(ids, scores.shape)])
+        keep = np.argsort(-best_scores, axis=1)[:, :k]
+        best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        best_ids = np.take_along_axis(best_ids, keep, axis=1)
+    return best_ids
+
+
+def recall(results, truth):
+    hits = sum(
+        len({int(r["verse"]) for r in found} & set(expected.tolist()))
+        for found, expected in zip(results, truth, strict=True)
+    )
+    return hits / truth.size
+
+
+def documents(matrix, verses_per_poem=12):
+    """(url, verses, vectors) documents, one fake poem per verses_per_poem rows; verses are row numbers."""
+    for start in range(0, len(matrix), verses_per_poem):
+        rows = range(start, min(start + verses_per_poem, len(matrix)))
+        yield (
+            f"{POEM_BASE_URL}sh{start // verses_per_poem + 1}/",
+            [str(i) for i in rows],
+            matrix[rows.start : rows.stop],
+        )
+
+
+def report(name, results, latencies, truth, k):
+    logger.info(
+        f"{name:<14} recall@{k}={recall(results, truth):.3f} "
+        f"p50={percentile(latencies, 0.5) * 1e3:.2f}ms p99={percentile(latencies, 0.99) * 1e3:.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--clusters", type=int, default=2000, help="clusters of the synthetic data")
+    parser.add_argument(
+        "--noise", type=float, default=1.0, help="spread around cluster centers; higher is harder"
+    )
+    parser.add_argument("--lists", type=int, default=None, help="IVF lists; default about 4 * sqrt(rows)")
+    parser.add_argument("--probes", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument(
+        "--exact-queries", type=int, default=20, help="queries timed on the (slow) exact scan"
+    )
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    rng = np.random.default_rng(0)
+
+    for size in args.sizes:
+        matrix = synthetic_vectors(size, args.dim, args.clusters, args.noise, rng)
+        # queries are perturbed corpus vectors, so each has close but not identical neighbours
+        queries = matrix[rng.integers(0, size, args.queries)] + 0.3 * rng.standard_normal(
+            (args.queries, args.dim)
+        ).astype(np.float32) / np.sqrt(args.dim)
+        truth = exact_top_k(matrix, queries, args.k)
+        query_vectors = queries.tolist()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "bench.db")
+            exact = Index(db_path=db_path, dim=args.dim)
+            start = time.perf_counter()
+            exact.add_documents(documents(matrix), batch_size=5000)
+            logger.info(f"--- {size} vectors, dim {args.dim}: loaded in {time.perf_counter() - start:.1f}s")
+
+            start = time.perf_counter()
+            exact.train_ivf(n_lists=args.lists)
+            logger.info(f"IVF training and assignment: {time.perf_counter() - start:.1f}s")
+
+            n = args.exact_queries
+            results, latencies = time_queries(exact.search, query_vectors[:n], args.k)
+            report("exact", results, latencies, truth[:n], args.k)
+
+            ivf = Index(db_path=db_path, dim=args.dim, ann="ivf")
+            for probes in args.probes:
+                ivf.probes = probes
+                results, latencies = time_queries(ivf.search, query_vectors, args.k)
+                report(f"ivf probes={probes}", results, latencies, truth, args.k)
+            logger.info(f"database size: {os.path.getsize(db_path) / 2**20:.0f} MiB")
+            del exact, ivf
+
+
+if __name__ == "__main__":
+    main()
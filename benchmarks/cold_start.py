@@ -0,0 +1,85 @@
+"""
+Cold-start budget check. Runs a startup statement (by default importing agent and registering its
+tools, i.e. everything before the REPL greeting) in fresh interpreters under `-X importtime`, then
+reports the median time and the slowest imports. Exits 1 when the median exceeds the budget or
+when a heavy dependency that should load lazily was imported.
+
+    uv run python -m benchmarks.cold_start
+    uv run python -m benchmarks.cold_start --statement "import index" --budget-ms 150
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import subprocess
+import sys
+
+logger = logging.getLogger(__name__)
+
+# dependencies that must only load on first use (API calls, index access, IVF training)
+LAZY_MODULES = ("openai", "logfire", "numpy", "sqlite_vec", "sentence_transformers")
+
+TIMED = """
+import time
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start)
+"""
+
+
+def run_once(statement):
+    """Returns (seconds, {module: cumulative import microseconds}) of one fresh interpreter."""
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "offline-benchmark")}
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", TIMED.format(statement=statement)],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    imports = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        imports[name.strip()] = int(cumulative)
+    return float(completed.stdout.split()[-1]), imports
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--statement", default="import agent; agent.build_registry()")
+    parser.add_argument("--budget-ms", type=float, default=250.0)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to report")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(message)s")
+    logger.setLevel(logging.INFO)
+
+    runs = [run_once(args.statement) for _ in range(args.runs)]
+    median_ms = statistics.median(seconds for seconds, _ in runs) * 1000
+    imports = runs[-1][1]
+    logger.info(
+        f"{args.statement!r}: median {median_ms:.0f}ms over {args.runs} runs (budget {args.budget_ms:.0f}ms)"
+    )
+    for name, cumulative in sorted(imports.items(), key=lambda item: item[1], reverse=True)[: args.top]:
+        logger.info(f"  {cumulative / 1000:8.1f}ms  {name}")
+
+    failed = False
+    eager = sorted({name.split(".")[0] for name in imports} & set(LAZY_MODULES))
+    if eager:
+        logger.error(f"imported at startup but meant to load lazily: {', '.join(eager)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        logger.error(f"cold start {median_ms:.0f}ms is over the {args.budget_ms:.0f}ms budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+Shared setup for the benchmarks: docs/ indexed into a throwaway database.
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+from index import index_directory
+from sqlite_helper import Index
+
+
+@contextmanager
+def indexed_docs(docs_dir, embed_fn, **index_options):
+    """
+    Indexes docs_dir with embed_fn into a fresh database in a temporary directory and yields
+    (index, rows). The vector table takes the embedder's dim; embed_fn without one (e.g.
+    index.get_embedding) gets the configured provider's. index_options go to index_directory.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        index = Index(db_path=os.path.join(tmp, "bench.db"), dim=getattr(embed_fn, "dim", None))
+        try:
+            rows = index_directory(docs_dir, index_instance=index, embed_fn=embed_fn, **index_options)
+            yield index, rows
+        finally:
+            index.conn.close()
@@ -0,0 +1,50 @@
+"""
+Measures index_directory throughput against a local fake embedder, so a full
+rebuild pipeline can be benchmarked without network access.
+
+    uv run python -m benchmarks.index_throughput --workers 1 4 8 --latency 0.2
+"""
+
+import argparse
+import logging
+import os
+import time
+
+# The benchmark never talks to OpenAI, but settings insists on a key.
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+from benchmarks.corpus import indexed_docs
+from embeddings import HashingEmbedder
+
+logger = logging.getLogger(__name__)
+
+
+def run(docs_dir, workers, latency, batch_items):
+    start = time.perf_counter()
+    embedder = HashingEmbedder(latency=latency)
+    with indexed_docs(docs_dir, embedder, workers=workers, max_batch_items=batch_items) as (_, rows):
+        elapsed = time.perf_counter() - start
+    return rows, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--docs", default="docs")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--latency", type=float, default=0.1, help="simulated seconds per embedding request")
+    parser.add_argument("--batch-items", type=int, default=512)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    for workers in args.workers:
+        rows, elapsed = run(args.docs, workers, args.latency, args.batch_items)
+        logger.info(
+            f"workers={workers:<3} rows={rows:<6} time={elapsed:.2f}s rate={rows / elapsed:.0f} rows/sec"
+        )
+
+
+if __name__ == "__main__":
+    main()
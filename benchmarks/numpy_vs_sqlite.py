@@ -0,0 +1,82 @@
+"""
+Compares the in-memory NumPy backend against sqlite-vec on docs/ (offline hashing
+embeddings): single-query latency, batched-query throughput and top-k agreement.
+
+    uv run python -m benchmarks.numpy_vs_sqlite --queries 200 --batch 32
+"""
+
+import argparse
+import logging
+import os
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+from benchmarks.corpus import indexed_docs
+from benchmarks.quantization_report import sample_queries
+from embeddings import HashingEmbedder
+from numpy_index import NumpyIndex
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def time_queries(search, query_vectors, top_k):
+    latencies = []
+    results = []
+    for vector in query_vectors:
+        start = time.perf_counter()
+        results.append(search(vector, top_k=top_k))
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return results, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--docs", default="docs")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    embedder = HashingEmbedder()
+    query_vectors = embedder(sample_queries(args.docs, args.queries))
+
+    with indexed_docs(args.docs, embedder) as (idx, _):
+        start = time.perf_counter()
+        np_idx = NumpyIndex.build(idx, os.path.join(os.path.dirname(idx.db_path), "bench.npy")).warmup()
+        logger.info(f"numpy export: {time.perf_counter() - start:.2f}s for {np_idx.matrix.shape[0]} vectors")
+
+        backends = {"sqlite-vec": idx.search, "numpy": np_idx.search}
+        results = {}
+        for name, search in backends.items():
+            results[name], latencies = time_queries(search, query_vectors, args.k)
+            logger.info(
+                f"{name:<10} p50={percentile(latencies, 0.5) * 1e3:.3f}ms "
+                f"p95={percentile(latencies, 0.95) * 1e3:.3f}ms p99={percentile(latencies, 0.99) * 1e3:.3f}ms"
+            )
+
+        start = time.perf_counter()
+        for i in range(0, len(query_vectors), args.batch):
+            np_idx.search_batch(query_vectors[i : i + args.batch], top_k=args.k)
+        elapsed = time.perf_counter() - start
+        logger.info(f"numpy batch={args.batch}: {len(query_vectors) / elapsed:.0f} queries/sec")
+
+        agreement = sum(
+            len({r["verse"] for r in a} & {r["verse"] for r in b})
+            for a, b in zip(results["sqlite-vec"], results["numpy"], strict=True)
+        ) / (len(query_vectors) * args.k)
+        logger.info(f"top-{args.k} agreement numpy vs sqlite-vec: {agreement:.3f}")
+        del idx
+
+
+if __name__ == "__main__":
+    main()
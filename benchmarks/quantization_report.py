@@ -0,0 +1,106 @@
+"""
+Recall@k vs. latency/size report for the coarse vector storage modes of Index
+(int8 / binary quantization, optionally truncated to fewer dimensions) on docs/.
+
+Recall is measured against the exact float32 search. Queries are the first hemistich
+of a sample of verses. By default everything is embedded with the offline
+HashingEmbedder; pass --openai to use real (cached) text-embedding-3 vectors, which is
+what Matryoshka truncation is meant for.
+
+    uv run python -m benchmarks.quantization_report --openai --k 10
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+from benchmarks.corpus import indexed_docs
+from embeddings import HashingEmbedder
+from index import _iter_files, get_embedding, parse_file, read_file_content
+from sqlite_helper import Index
+
+logger = logging.getLogger(__name__)
+
+MODES = [
+    ("float32", None),
+    ("int8", None),
+    ("int8", 512),
+    ("int8", 256),
+    ("bit", None),
+    ("bit", 512),
+]
+
+
+def sample_queries(docs_dir, n, seed=0):
+    hemistichs = []
+    for filepath in _iter_files(docs_dir, ""):
+        _, _, verses = parse_file(read_file_content(filepath), filepath)
+        hemistichs.extend(verse.split(" / ")[0] for verse in verses)
+    random.Random(seed).shuffle(hemistichs)
+    return hemistichs[:n]
+
+
+def coarse_bytes_per_row(storage, dim):
+    return {"float32": 0, "int8": dim, "bit": dim // 8}[storage]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--docs", default="docs")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--openai", action="store_true", help="embed with the (cached) OpenAI model")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    embed_fn = get_embedding if args.openai else HashingEmbedder()
+    queries = sample_queries(args.docs, args.queries)
+    query_vectors = embed_fn(queries)
+
+    report = []
+    with indexed_docs(args.docs, embed_fn) as (exact_idx, _):
+        db_path = exact_idx.db_path
+        exact = [{r["verse"] for r in exact_idx.search(v, top_k=args.k)} for v in query_vectors]
+
+        for storage, dim in MODES:
+            idx = Index(db_path=db_path, storage=storage, coarse_dim=dim)
+            latencies = []
+            hits = 0
+            for vector, expected in zip(query_vectors, exact, strict=True):
+                start = time.perf_counter()
+                results = idx.search(vector, top_k=args.k)
+                latencies.append(time.perf_counter() - start)
+                hits += len(expected & {r["verse"] for r in results})
+            latencies.sort()
+            row = {
+                "storage": storage,
+                "dim": idx.coarse_dim,
+                f"recall@{args.k}": hits / (len(exact) * args.k),
+                "p50_ms": latencies[len(latencies) // 2] * 1e3,
+                "p95_ms": latencies[int(len(latencies) * 0.95)] * 1e3,
+                "coarse_bytes_per_row": coarse_bytes_per_row(storage, idx.coarse_dim),
+            }
+            report.append(row)
+            logger.info(
+                f"{storage:<8} dim={row['dim']:<5} recall@{args.k}={row[f'recall@{args.k}']:.3f} "
+                f"p50={row['p50_ms']:.2f}ms p95={row['p95_ms']:.2f}ms coarse={row['coarse_bytes_per_row']}B/row"
+            )
+            del idx
+        logger.info(f"database size with all coarse tables: {os.path.getsize(db_path) / 1e6:.1f} MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
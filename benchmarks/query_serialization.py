@@ -0,0 +1,55 @@
+"""
+Compares JSON text vs. float32 blob query vectors for Index.search: the serialization
+cost alone, and end-to-end KNN latency over docs/ indexed with the offline embedder.
+
+    uv run python -m benchmarks.query_serialization --repeat 200
+"""
+
+import argparse
+import json
+import logging
+import os
+import timeit
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+from sqlite_vec import serialize_float32
+
+from benchmarks.corpus import indexed_docs
+from embeddings import HashingEmbedder
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--docs", default="docs")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    embedder = HashingEmbedder()
+    query_vector = embedder(["شمع و پروانه"])[0]
+
+    for name, serialize in (("json", json.dumps), ("float32", serialize_float32)):
+        seconds = timeit.timeit(lambda serialize=serialize: serialize(query_vector), number=args.repeat)
+        logger.info(f"serialize {name:<8} {seconds / args.repeat * 1e6:8.1f} us/query")
+
+    with indexed_docs(args.docs, embedder) as (idx, _):
+        sql = f"SELECT url, verse, distance FROM {idx.table_name} WHERE embedding MATCH ? AND hemistich = 0 ORDER BY distance LIMIT ?;"
+        for name, serialize in (("json", json.dumps), ("float32", serialize_float32)):
+            seconds = timeit.timeit(
+                lambda serialize=serialize, idx=idx: idx.conn.execute(
+                    sql, (serialize(query_vector), args.top_k)
+                ).fetchall(),
+                number=args.repeat,
+            )
+            logger.info(f"search    {name:<8} {seconds / args.repeat * 1e3:8.3f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
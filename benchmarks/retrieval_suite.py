@@ -0,0 +1,215 @@
+"""
+End-to-end retrieval benchmark that runs without network access. It builds an index of the docs
+into a temporary database, replays a labeled query set against it and reports, as JSON:
+
+- build: rows, seconds, rows/sec and database size;
+- search / lexical / tool: p50, p95 and p99 latency of Index.search, Index.lexical_search and
+  semantic_search_tool (cold result cache, then warm);
+- quality: poem-level recall@k and MRR of vector search and of the tool;
+- stages: per-stage timings (embed, knn, lexical, fuse, serialize) recorded by timing.span.
+
+Embeddings come from EMBEDDING_MODEL, which this script defaults to "hashing". Set it to
+"recorded:<model>" to replay vectors a real model produced earlier, as stored in the embedding
+cache (index the docs and run the queries once online to record them):
+
+    uv run python -m benchmarks.retrieval_suite --output results.json
+    EMBEDDING_MODEL=recorded:text-embedding-3-small uv run python -m benchmarks.retrieval_suite
+    uv run python -m benchmarks.retrieval_suite --baseline results.json   # exits 1 on a regression
+
+The labeled queries (benchmarks/queries.jsonl) are known-item queries, one JSON object per line:
+{"query": ..., "kind": "hemistich" | "fragment" | "reversed", "relevant": ["sh12"]}; --write-queries
+regenerates them from the docs.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+os.environ.setdefault("EMBEDDING_MODEL", "hashing")
+
+from benchmarks.corpus import indexed_docs
+from benchmarks.numpy_vs_sqlite import time_queries
+from embeddings import get_embedding_provider
+from index import parse_file, read_file_content
+from sqlite_helper import poem_ref
+from timing import get_stage_timer, percentile
+from tools.semantic_search import encode_search_results, semantic_search_tool
+
+logger = logging.getLogger(__name__)
+
+QUERIES_PATH = os.path.join(os.path.dirname(__file__), "queries.jsonl")
+
+# metrics where a larger value is better; for every other metric smaller is better
+HIGHER_IS_BETTER = ("recall", "mrr", "rows_per_sec")
+
+
+def make_queries(docs_dir, every=10):
+    """
+    Known-item queries from every `every`-th poem of docs_dir, labeled with the poem they come from.
+    They rotate between a whole hemistich, a three-word fragment of one (both usually answered by the
+    exact-phrase fast path) and a hemistich with its words reversed, which always takes the vector path.
+    """
+    queries = []
+    for n, filename in enumerate(sorted(os.listdir(docs_dir))[::every]):
+        url, poem_id, verses = parse_file(read_file_content(os.path.join(docs_dir, filename)), filename)
+        verse = verses[n % len(verses)]
+        first, _, second = verse.partition(" / ")
+        words = first.split()
+        if n % 3 == 0:
+            query, kind = (second or first).strip(), "hemistich"
+        elif n % 3 == 1:
+            query, kind = " ".join(words[1:4] if len(words) > 4 else words[:3]), "fragment"
+        else:
+            query, kind = " ".join(reversed(words)), "reversed"
+        queries.append({"query": query, "kind": kind, "relevant": [poem_id]})
+    return queries
+
+
+def load_queries(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def latency_stats(latencies):
+    latencies = sorted(latencies)
+    return {f"p{int(p * 100)}_ms": percentile(latencies, p) * 1000 for p in (0.5, 0.95, 0.99)}
+
+
+def poem_ids(results):
+    return [poem_ref(result["url"]) for result in results]
+
+
+def quality(results, queries, k):
+    """Poem-level recall@k (a relevant poem among the top k hits) and mean reciprocal rank."""
+    hits = 0
+    reciprocal_ranks = 0.0
+    for found, query in zip(results, queries, strict=True):
+        ranked = list(dict.fromkeys(poem_ids(found)))[:k]
+        ranks = [ranked.index(poem) + 1 for poem in query["relevant"] if poem in ranked]
+        hits += bool(ranks)
+        reciprocal_ranks += 1 / min(ranks) if ranks else 0.0
+    return {f"recall@{k}": hits / len(queries), "mrr": reciprocal_ranks / len(queries)}
+
+
+def time_tool(index, queries, k):
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        found = semantic_search_tool([query["query"]], top_k=k, index_instance=index)
+        encode_search_results(found)
+        latencies.append(time.perf_counter() - start)
+        results.append(found)
+    return results, latencies
+
+
+def run(docs_dir, queries, k):
+    provider = get_embedding_provider()
+    report = {"embedding_model": provider.name, "queries": len(queries), "k": k}
+    start = time.perf_counter()
+    with indexed_docs(docs_dir, provider) as (index, rows):
+        elapsed = time.perf_counter() - start
+        index.conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        report["build"] = {
+            "rows": rows,
+            "seconds": elapsed,
+            "rows_per_sec": rows / elapsed,
+            "db_size_bytes": os.path.getsize(index.db_path),
+        }
+
+        vectors = provider([query["query"] for query in queries])
+        if vectors is None:
+            raise SystemExit(f"could not embed the queries with {provider.name}")
+        results, latencies = time_queries(index.search, vectors, k)
+        report["search"] = latency_stats(latencies)
+        report["quality"] = {"search": quality(results, queries, k)}
+
+        _, latencies = time_queries(index.lexical_search, [query["query"] for query in queries], k)
+        report["lexical"] = latency_stats(latencies)
+
+        get_stage_timer().reset()
+        results, latencies = time_tool(index, queries, k)
+        report["tool_cold"] = latency_stats(latencies)
+        report["quality"]["tool"] = quality(results, queries, k)
+        _, latencies = time_tool(index, queries, k)
+        report["tool_warm"] = latency_stats(latencies)
+        report["stages"] = get_stage_timer().stats()
+        del index
+    return report
+
+
+def flatten(report, prefix=""):
+    for key, value in report.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)):
+            yield f"{prefix}{key}", value
+
+
+def compare(report, baseline, tolerance):
+    """
+    Logs metrics that moved by more than tolerance (relative) against baseline and returns the
+    regressions. Stage timings are sub-millisecond and noisy, so they are only reported.
+    """
+    before = dict(flatten(baseline))
+    regressions = []
+    for name, value in flatten(report):
+        old = before.get(name)
+        if not old or name in ("queries", "k", "build.rows") or name.endswith(".count"):
+            continue
+        change = (value - old) / old
+        if abs(change) <= tolerance:
+            continue
+        worse = change < 0 if any(part in name for part in HIGHER_IS_BETTER) else change > 0
+        gated = worse and not name.startswith("stages.")
+        label = "REGRESSION" if gated else "worse" if worse else "better"
+        logger.info(f"{label} {name}: {old:.4g} -> {value:.4g} ({change:+.0%})")
+        if gated:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--docs", default="docs")
+    parser.add_argument("--queries", default=QUERIES_PATH, help="labeled query set (JSON lines)")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="relative change reported as a regression"
+    )
+    parser.add_argument(
+        "--write-queries", action="store_true", help="regenerate --queries from --docs and exit"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(message)s")
+    logger.setLevel(logging.INFO)
+
+    if args.write_queries:
+        queries = make_queries(args.docs)
+        with open(args.queries, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(query, ensure_ascii=False) + "\n" for query in queries)
+        logger.info(f"wrote {len(queries)} queries to {args.queries}")
+        return
+
+    report = run(args.docs, load_queries(args.queries), args.k)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Load test of the asyncio agent server (server.py) with a stubbed model, so that only the server,
+the tools and the index are measured. The docs are indexed with the offline hashing embedder into
+a temporary database, the server is started in-process on a free port, and simulated users open
+sessions, send messages and close them over HTTP.
+
+Each message costs two stub model calls: the first asks for semantic_search_tool with a query from
+benchmarks/queries.jsonl, the second answers once the tool output is in the conversation.
+
+    uv run python -m benchmarks.server_load --sessions 500 --concurrency 64 --llm-latency 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+os.environ.setdefault("EMBEDDING_MODEL", "hashing")
+
+from benchmarks.corpus import indexed_docs
+from benchmarks.retrieval_suite import QUERIES_PATH, load_queries
+from embeddings import get_embedding_provider
+from server import AgentServer
+from sqlite_helper import get_index_pool
+from timing import percentile
+from tools.registry import ToolRegistry
+from tools.semantic_search import semantic_search_tool
+
+logger = logging.getLogger(__name__)
+
+
+class StubResponses:
+    """Awaitable stand-in for AsyncOpenAI().responses: one tool call, then a text answer."""
+
+    def __init__(self, queries, latency, seed=0):
+        self.queries = queries
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    async def create(self, model, input, tools):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        last = input[-1]
+        if isinstance(last, dict) and last.get("type") == "function_call_output":
+            return SimpleNamespace(output=[], output_text=f"found {len(last['output'])} characters of verses")
+        call = SimpleNamespace(
+            type="function_call",
+            id=f"fc_{self.calls}",
+            call_id=f"call_{self.calls}",
+            name="semantic_search_tool",
+            arguments=json.dumps({"queries": [self.rng.choice(self.queries)]}, ensure_ascii=False),
+        )
+        return SimpleNamespace(output=[call], output_text="")
+
+
+async def request(port, method, path, payload=None):
+    """One HTTP request to the local server; returns (status, decoded JSON body)."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1")
+        + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, data = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(data)
+
+
+async def user(port, messages, turn_latencies, failures):
+    """One simulated user: opens a session, sends messages one after another, closes it."""
+    status, created = await request(port, "POST", "/sessions")
+    if status != 201:
+        failures.append(status)
+        return
+    path = f"/sessions/{created['session_id']}"
+    for n in range(messages):
+        start = time.perf_counter()
+        status, _ = await request(port, "POST", f"{path}/messages", {"content": f"question {n}"})
+        if status != 200:
+            failures.append(status)
+            continue
+        turn_latencies.append(time.perf_counter() - start)
+    await request(port, "DELETE", path)
+
+
+async def load_test(server, sessions, concurrency, messages):
+    listener = await server.start("127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    turn_latencies, failures = [], []
+    pending = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with pending:
+            await user(port, messages, turn_latencies, failures)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(sessions)))
+    elapsed = time.perf_counter() - start
+    _, stats = await request(port, "GET", "/stats")
+    listener.close()
+    await listener.wait_closed()
+    return elapsed, sorted(turn_latencies), failures, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--docs", default="docs")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32, help="simulated users at once")
+    parser.add_argument("--messages", type=int, default=2, help="messages per session")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per stub model call")
+    parser.add_argument("--max-turns", type=int, default=None, help="server turn slots (default: settings)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(message)s")
+    logger.setLevel(logging.INFO)
+
+    with indexed_docs(args.docs, get_embedding_provider()) as (index, rows):
+        logger.info(f"indexed {rows} rows")
+
+        registry = ToolRegistry()
+        registry.register(semantic_search_tool, index_instance=get_index_pool(index.db_path))
+        queries = [query["query"] for query in load_queries(QUERIES_PATH)]
+        limits = {} if args.max_turns is None else {"max_concurrent_turns": args.max_turns}
+        server = AgentServer(
+            registry, llm=SimpleNamespace(responses=StubResponses(queries, args.llm_latency)), **limits
+        )
+        elapsed, latencies, failures, stats = asyncio.run(
+            load_test(server, args.sessions, args.concurrency, args.messages)
+        )
+
+    logger.info(
+        f"{args.sessions} sessions x {args.messages} messages in {elapsed:.2f}s: "
+        f"{args.sessions / elapsed:.1f} sessions/sec, {len(latencies) / elapsed:.1f} turns/sec, {len(failures)} failed"
+    )
+    if latencies:
+        logger.info(
+            "turn latency "
+            + " ".join(f"p{int(p * 100)}={percentile(latencies, p) * 1000:.0f}ms" for p in (0.5, 0.95, 0.99))
+        )
+    for stage, timing in stats["stages"].items():
+        logger.info(
+            f"  {stage:<14} n={timing['count']:<6} p50={timing['p50_ms']:.1f}ms p99={timing['p99_ms']:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Token savings of the compact semantic_search_tool encoder against the old str(list of dicts)
+format, on sample multi-query searches over docs/ (offline hashing embeddings).
+Uses tiktoken when it is installed, the conversation module's estimate otherwise.
+
+    uv run python -m benchmarks.tool_output_tokens --top-k 5
+"""
+
+import argparse
+import logging
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+from benchmarks.corpus import indexed_docs
+from conversation import estimate_tokens
+from embeddings import HashingEmbedder
+from tools.semantic_search import encode_search_results, reciprocal_rank_fusion
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_QUERIES = [
+    ["شمع"],
+    ["ساقی", "می", "جام"],
+    ["شمع و پروانه", "سوختن عاشق"],
+    ["الا یا ایها الساقی"],
+    ["زلف یار", "بوی نافه", "صبا"],
+    ["رند", "زاهد", "صوفی", "خرقه"],
+]
+
+
+def count_tokens_fn():
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("o200k_base")
+        return lambda text: len(encoding.encode(text)), "tiktoken o200k_base"
+    except ImportError:
+        return estimate_tokens, "estimate"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--docs", default="docs")
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    count_tokens, counter = count_tokens_fn()
+    embedder = HashingEmbedder()
+
+    with indexed_docs(args.docs, embedder) as (idx, _):
+        total_old = total_new = 0
+        for queries in SAMPLE_QUERIES:
+            results = reciprocal_rank_fusion(idx.search_batch(embedder(queries), top_k=args.top_k))
+            old, new = count_tokens(str(results)), count_tokens(encode_search_results(results))
+            total_old += old
+            total_new += new
+            logger.info(
+                f"{' | '.join(queries):<40} hits={len(results):<3} str={old:<6} compact={new:<6} ({1 - new / old:.0%} saved)"
+            )
+        logger.info(
+            f"total ({counter}): str={total_old} compact={total_new} ({1 - total_new / total_old:.0%} saved)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import logging
+import threading
+
+from settings import LOGFIRE_API_KEY, OPENAI_API_KEY
+
+logger = logging.getLogger(__name__)
+
+_openai_client = None
+_async_openai_client = None
+_openai_lock = threading.Lock()
+_logfire_configured = False
+
+
+def _configure_logfire():
+    """Sends traces of OpenAI calls to logfire when LOGFIRE_API_KEY is set (once per process)."""
+    global _logfire_configured
+    if not LOGFIRE_API_KEY or _logfire_configured:
+        return
+    _logfire_configured = True
+    import logfire
+
+    logfire.configure(token=LOGFIRE_API_KEY, console=False)
+    logfire.instrument_openai()
+
+
+def get_openai_client():
+    """
+    Returns the process-wide OpenAI client, shared by chat and embedding calls. openai (and logfire,
+    when configured) are imported on the first call, so importing a module never pays for them.
+    """
+    global _openai_client
+    with _openai_lock:
+        if _openai_client is None:
+            import openai
+
+            _configure_logfire()
+            _openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+            logger.info("Created the OpenAI client.")
+        return _openai_client
+
+
+def get_async_openai_client():
+    """Returns the process-wide AsyncOpenAI client of the asyncio server, created on first use."""
+    global _async_openai_client
+    with _openai_lock:
+        if _async_openai_client is None:
+            import openai
+
+            _configure_logfire()
+            _async_openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+            logger.info("Created the async OpenAI client.")
+        return _async_openai_client
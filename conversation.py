@@ -0,0 +1,143 @@
+import logging
+
+from settings import CONTEXT_TOKEN_BUDGET
+from sqlite_helper import poem_ref
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate, shared by the context budget and embedding request packing. Persian runs
+    close to one token per two characters (English closer to four), so this errs on the high side.
+    """
+    return max(1, len(text) // 2)
+
+
+def _message_text(message):
+    if isinstance(message, dict):
+        return str(message.get("content") or message.get("output") or "")
+    # function_call items from the Responses API
+    return f"{getattr(message, 'name', '')}{getattr(message, 'arguments', '')}"
+
+
+def _is_user_message(message):
+    return isinstance(message, dict) and message.get("role") == "user"
+
+
+class ConversationContext:
+    """
+    Holds the messages sent to the model and keeps them under a token budget.
+
+    - tool outputs that are lists of search hits are deduplicated against verses already shown
+      in the conversation;
+    - once the estimated prompt size exceeds token_budget, tool outputs of earlier exchanges are
+      collapsed into compact references (poem ids), and if that is not enough the oldest
+      exchanges are dropped. The developer message and the current exchange are never touched.
+    """
+
+    def __init__(self, developer_message, token_budget=CONTEXT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.messages = [developer_message]
+        self._tokens = [estimate_tokens(_message_text(developer_message))]
+        self._hits = {}  # id(function_call_output message) -> list of hits it carried
+        self._shown_verses = set()
+
+    @property
+    def total_tokens(self):
+        return sum(self._tokens)
+
+    def append(self, message):
+        self.messages.append(message)
+        self._tokens.append(estimate_tokens(_message_text(message)))
+        self._enforce_budget()
+
+    def checkpoint(self):
+        """Snapshot of the conversation for restore(), e.g. to undo a turn that failed halfway."""
+        return list(self.messages), list(self._tokens), dict(self._hits), set(self._shown_verses)
+
+    def restore(self, checkpoint):
+        """Returns the conversation to a checkpoint(), including messages compacted or dropped since."""
+        messages, tokens, hits, shown_verses = checkpoint
+        self.messages, self._tokens = list(messages), list(tokens)
+        self._hits, self._shown_verses = dict(hits), set(shown_verses)
+
+    def add_tool_result(self, tool_call, tool_output, encoder=str):
+        """
+        Appends a tool call and its output serialized with encoder, dropping search hits already
+        shown earlier in the conversation.
+        """
+        hits = None
+        if isinstance(tool_output, list) and all(isinstance(h, dict) and "verse" in h for h in tool_output):
+            hits = [h for h in tool_output if (h.get("url"), h["verse"]) not in self._shown_verses]
+            repeated = [h for h in tool_output if (h.get("url"), h["verse"]) in self._shown_verses]
+            self._shown_verses.update((h.get("url"), h["verse"]) for h in hits)
+            output = encoder(hits)
+            if repeated:
+                refs = ", ".join(sorted({poem_ref(h.get("url", "")) for h in repeated}))
+                output += f"\n(also matched {len(repeated)} verses already shown earlier, from {refs})"
+        else:
+            output = encoder(tool_output)
+
+        self.messages.append(tool_call)
+        self._tokens.append(estimate_tokens(_message_text(tool_call)))
+        output_message = {"type": "function_call_output", "call_id": tool_call.call_id, "output": output}
+        if hits is not None:
+            self._hits[id(output_message)] = hits
+        self.append(output_message)
+
+    def _current_exchange_start(self):
+        for i in range(len(self.messages) - 1, 0, -1):
+            if _is_user_message(self.messages[i]):
+                return i
+        return 1
+
+    def _forget_hits(self, message):
+        """
+        Drops the hits carried by a tool output that is compacted or dropped, so that searching for
+        them again returns their text instead of an "already shown" note.
+        """
+        hits = self._hits.pop(id(message), None)
+        if hits:
+            self._shown_verses.difference_update((h.get("url"), h["verse"]) for h in hits)
+        return hits
+
+    def _compact_output(self, i):
+        message = self.messages[i]
+        hits = self._forget_hits(message)
+        if hits is None:
+            summary = f"[compacted tool output of ~{self._tokens[i]} tokens]"
+        else:
+            refs = ", ".join(sorted({poem_ref(h.get("url", "")) for h in hits}))
+            summary = f"[compacted: {len(hits)} verses from {refs or 'no poems'}; search again for the text]"
+        self.messages[i] = {**message, "output": summary}
+        self._tokens[i] = estimate_tokens(summary)
+
+    def _enforce_budget(self):
+        if self.total_tokens <= self.token_budget:
+            return
+        before = self.total_tokens
+        current = self._current_exchange_start()
+
+        # 1. collapse tool outputs of earlier exchanges, oldest first
+        for i in range(1, current):
+            if self.total_tokens <= self.token_budget:
+                break
+            message = self.messages[i]
+            if isinstance(message, dict) and message.get("type") == "function_call_output":
+                if not message["output"].startswith("[compacted"):
+                    self._compact_output(i)
+
+        # 2. drop whole earlier exchanges (user message up to the next one), oldest first,
+        # so function calls are never separated from their outputs
+        while self.total_tokens > self.token_budget:
+            current = self._current_exchange_start()
+            end = next((i for i in range(2, current + 1) if _is_user_message(self.messages[i])), None)
+            if end is None:
+                break
+            for message in self.messages[1:end]:
+                self._forget_hits(message)
+            del self.messages[1:end]
+            del self._tokens[1:end]
+
+        logger.info(f"Compacted conversation from ~{before} to ~{self.total_tokens} tokens.")
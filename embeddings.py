@@ -0,0 +1,316 @@
+import abc
+import hashlib
+import logging
+import math
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import batched
+
+from clients import get_openai_client
+from settings import (
+    EMBEDDING_BATCH_ITEMS,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_DIM,
+    EMBEDDING_MODEL,
+    LOCAL_EMBEDDING_BATCH_SIZE,
+    LOCAL_EMBEDDING_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingProvider(abc.ABC):
+    """
+    An embedding backend: a callable mapping a list of texts to a list of vectors, or None on failure.
+    `name` identifies the model that produced the vectors (it keys the embedding cache and is recorded
+    in the index) and `dim` is their dimension. Inputs are split into batches of at most batch_size
+    texts, embedded on a pool of `workers` threads when there is more than one batch.
+    """
+
+    name = None
+    dim = None
+    batch_size = EMBEDDING_BATCH_ITEMS
+    workers = 1
+
+    @abc.abstractmethod
+    def embed(self, texts):
+        """Embeds one batch of texts; raises on failure."""
+
+    def __call__(self, texts):
+        texts = [text.replace("\n", " ") for text in texts]
+        batches = [list(batch) for batch in batched(texts, self.batch_size)]
+        try:
+            if self.workers > 1 and len(batches) > 1:
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embed") as pool:
+                    results = list(pool.map(self.embed, batches))
+            else:
+                results = [self.embed(batch) for batch in batches]
+        except Exception as e:
+            logger.error(f"Error generating embedding with {self.name}: {e}")
+            return None
+        return [vector for result in results for vector in result]
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embeddings from the OpenAI API, through the shared client created on first use."""
+
+    # the API accepts up to 2048 inputs per request
+    batch_size = 2048
+
+    def __init__(self, model=EMBEDDING_MODEL, dim=EMBEDDING_DIM):
+        self.name = model
+        self.dim = dim
+
+    def embed(self, texts):
+        response = get_openai_client().embeddings.create(input=texts, model=self.name)
+        return [i.embedding for i in response.data]
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    CPU embeddings from a sentence-transformers model (e.g. paraphrase-multilingual-MiniLM-L12-v2),
+    loaded on first use. Requires the optional `sentence-transformers` dependency.
+    Batches run on a thread pool; the model releases the GIL during inference.
+    """
+
+    def __init__(self, model_name, batch_size=LOCAL_EMBEDDING_BATCH_SIZE, workers=LOCAL_EMBEDDING_WORKERS):
+        self.model_name = model_name
+        self.name = f"local:{model_name}"
+        self.batch_size = batch_size
+        self.workers = workers
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+
+                self._model = SentenceTransformer(self.model_name, device="cpu")
+                logger.info(f"Loaded local embedding model {self.model_name}.")
+            return self._model
+
+    @property
+    def dim(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        return self.model.encode(texts, batch_size=len(texts), normalize_embeddings=True).tolist()
+
+
+class HashingEmbedder(EmbeddingProvider):
+    """
+    Deterministic offline embedder that feature-hashes words into a normalized vector.
+    Useful for tests and for benchmarking without network access.
+    latency (seconds) is slept once per batch to simulate a remote round trip.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, latency=0.0):
+        self.name = f"hashing-{dim}"
+        self.dim = dim
+        self.latency = latency
+
+    def embed_text(self, text):
+        vector = [0.0] * self.dim
+        for word in text.split():
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[bucket] += sign
+        norm = math.sqrt(sum(v * v for v in vector))
+        if norm:
+            vector = [v / norm for v in vector]
+        return vector
+
+    def embed(self, texts):
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.embed_text(text) for text in texts]
+
+
+class RecordedEmbedder(EmbeddingProvider):
+    """
+    Replays vectors that `model` produced earlier, as recorded in the embedding cache database, so
+    benchmarks and offline runs see the real model's vectors without network access. A text that was
+    never embedded by `model` fails the call, unless a fallback provider is given.
+    """
+
+    def __init__(self, model, cache_path=EMBEDDING_CACHE_PATH, dim=EMBEDDING_DIM, fallback=None):
+        self.name = model
+        self.dim = dim
+        self.cache_path = cache_path
+        self.fallback = fallback
+        self.replayed = 0
+        self.conn = sqlite3.connect(f"file:{cache_path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def embed(self, texts):
+        vectors = []
+        for text in texts:
+            _, text_hash = EmbeddingCache._key(self.name, text)
+            with self._lock:
+                row = self.conn.execute(
+                    "SELECT embedding FROM embedding_cache WHERE model = ? AND text_hash = ?;",
+                    (self.name, text_hash),
+                ).fetchone()
+            if row is not None:
+                self.replayed += 1
+                vectors.append(array("f", row[0]).tolist())
+            elif self.fallback is not None:
+                vectors.extend(self.fallback.embed([text]))
+            else:
+                raise KeyError(f"no recorded {self.name} embedding for {text[:40]!r}")
+        return vectors
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_embedding_provider(spec=EMBEDDING_MODEL):
+    """
+    Returns the process-wide provider for an EMBEDDING_MODEL value:
+    "hashing" (HashingEmbedder of EMBEDDING_DIM), "local:<sentence-transformers model>",
+    "recorded:<model>" (RecordedEmbedder) or any other value as an OpenAI embedding model name.
+    """
+    with _providers_lock:
+        if spec not in _providers:
+            if spec == "hashing":
+                _providers[spec] = HashingEmbedder()
+            elif spec.startswith("local:"):
+                _providers[spec] = LocalEmbeddingProvider(spec.removeprefix("local:"))
+            elif spec.startswith("recorded:"):
+                _providers[spec] = RecordedEmbedder(spec.removeprefix("recorded:"))
+            else:
+                _providers[spec] = OpenAIEmbeddingProvider(spec)
+        return _providers[spec]
+
+
+def embed_cached(texts, provider=None):
+    """Returns embeddings for texts, calling the provider (default: EMBEDDING_MODEL's) only for cache misses."""
+    provider = provider or get_embedding_provider()
+    return get_embedding_cache().get_many(provider.name, texts, provider)
+
+
+def normalize_text(text):
+    """Normalizes text for cache keys: NFC, newlines folded and whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """
+    Embedding cache keyed by (model, sha256 of normalized text).
+    Vectors are stored as float32 blobs in a SQLite table, with an in-process LRU of packed float32
+    arrays in front of it (~6 KiB a vector at 1536 dims, against ~48 KiB as a list of floats).
+    Safe to share between threads.
+    """
+
+    def __init__(self, db_path=EMBEDDING_CACHE_PATH, max_memory_items=EMBEDDING_CACHE_SIZE):
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            ) WITHOUT ROWID;
+            """
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def _key(model, text):
+        return model, hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model, texts, compute_fn):
+        """
+        Returns embeddings for texts, calling compute_fn(list_of_texts) only for cache misses.
+        Returns None if compute_fn fails (returns None) for the misses.
+        """
+        keys = [self._key(model, text) for text in texts]
+        results = [None] * len(texts)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                packed = self._memory.get(key)
+                if packed is not None:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    results[i] = packed.tolist()
+                    continue
+                row = self.conn.execute(
+                    "SELECT embedding FROM embedding_cache WHERE model = ? AND text_hash = ?;", key
+                ).fetchone()
+                if row is not None:
+                    packed = array("f", row[0])
+                    self._remember(key, packed)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    results[i] = packed.tolist()
+                else:
+                    missing.append(i)
+            self.misses += len(missing)
+
+        if missing:
+            computed = compute_fn([texts[i] for i in missing])
+            if computed is None:
+                return None
+            with self._lock:
+                blobs = []
+                for i, vector in zip(missing, computed, strict=True):
+                    packed = array("f", vector)
+                    self._remember(keys[i], packed)
+                    results[i] = vector
+                    blobs.append((*keys[i], packed.tobytes()))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO embedding_cache (model, text_hash, embedding) VALUES (?, ?, ?);",
+                    blobs,
+                )
+                self.conn.commit()
+        return results
+
+    def stats(self):
+        """Returns hit/miss counters."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Returns the process-wide embedding cache, opening it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
@@ -1,27 +1,37 @@
+import argparse
+import hashlib
 import logging
 import os
-
-import openai
-
-from settings import DB_PATH, EMBEDDING_MODEL, OPENAI_API_KEY, TABLE_NAME
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+
+from conversation import estimate_tokens
+from embeddings import EmbeddingProvider, embed_cached, get_embedding_cache, get_embedding_provider
+from settings import (
+    COLLECTIONS,
+    EMBEDDING_BATCH_ITEMS,
+    EMBEDDING_BATCH_TOKENS,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_WORKERS,
+    INDEX_BATCH_SIZE,
+    INDEX_HEMISTICHS,
+)
 from sqlite_helper import Index
 from tools.semantic_search import semantic_search_tool
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-_openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
-
 
-def get_embedding(verses, model=EMBEDDING_MODEL):
-    """Generates an embedding for the given text using the specified OpenAI model."""
-    try:
-        text = [verse.replace("\n", " ") for verse in verses]
-        response = _openai_client.embeddings.create(input=text, model=model)
-        return [i.embedding for i in response.data]
-    except Exception as e:
-        logger.error(f"Error generating embedding: {e}")
-        return None
+def get_embedding(verses, provider=None):
+    """
+    Returns embeddings for the given verses, calling the embedding provider (default: the one
+    selected by settings.EMBEDDING_MODEL) only for verses missing from the embedding cache.
+    """
+    return embed_cached(verses, provider)
 
 
 def read_file_content(filepath):
@@ -79,108 +89,393 @@ def parse_file(content: str, filename: str) -> tuple[str, str, list[str]]:
     return url, poem_id, verses
 
 
-def index_directory(directory_path, index_instance: Index = None):
+def verse_units(verses, hemistichs=INDEX_HEMISTICHS):
     """
-    Walks a directory, embeds each file/chunk, and stores vectors in the given index instance.
+    Returns the rows to embed for a poem's beyts as ((beyt, hemistich), text) pairs: each beyt whole
+    (hemistich 0), followed, if hemistichs is set, by its two halves (1 and 2) split at " / ".
     """
-    if index_instance is None:
-        idx = Index()
-    else:
-        idx = index_instance
-    logger.info(f"Starting indexing for directory: {directory_path} into {idx.db_path}/{idx.table_name}")
-    file_count = 0
-    indexed_count = 0
+    units = []
+    for beyt, verse in enumerate(verses, start=1):
+        units.append(((beyt, 0), verse))
+        halves = [half.strip() for half in verse.split(" / ")]
+        if hemistichs and len(halves) == 2 and all(halves):
+            units.extend(((beyt, hemistich), half) for hemistich, half in enumerate(halves, start=1))
+    return units
+
+
+def _is_indexable(file, db_path):
+    """Skips common non-text or large binary files, and the index file itself."""
+    return not (
+        file.startswith(".")
+        or file == os.path.basename(db_path)  # Skip the database file itself
+        or file.endswith(
+            (
+                ".png",
+                ".jpg",
+                ".jpeg",
+                ".gif",
+                ".zip",
+                ".tar.gz",
+                ".exe",
+                ".dll",
+                ".so",
+                ".o",
+                ".pyc",
+                ".db-shm",
+                ".db-wal",
+            )
+        )
+    )
+
+
+def _embed_with_retry(embed_fn, texts, max_retries=EMBEDDING_MAX_RETRIES, backoff=0.5):
+    """Calls embed_fn, retrying failed batches with exponential backoff. Returns None when all attempts fail."""
+    for attempt in range(max_retries + 1):
+        try:
+            embeddings = embed_fn(texts)
+        except Exception as e:
+            logger.warning(f"Embedding batch of {len(texts)} failed (attempt {attempt + 1}): {e}")
+            embeddings = None
+        if embeddings is not None:
+            return embeddings
+        if attempt < max_retries:
+            time.sleep(backoff * 2**attempt)
+    logger.error(f"Giving up on embedding batch of {len(texts)} verses after {max_retries + 1} attempts.")
+    return None
+
+
+def _put(q, item, stop):
+    """Blocking put that gives up once the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    """Blocking get that returns None once the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+
+def _iter_files(directory_path, db_path):
+    """Yields the paths of all indexable files under directory_path."""
     for root, _, files in os.walk(directory_path):
         for file in files:
-            file_count += 1
-            # Skip common non-text or large binary files, and the index file itself
-            if (
-                file.startswith(".")
-                or file == os.path.basename(idx.db_path)  # Skip the database file itself
-                or file.endswith(
-                    (
-                        ".png",
-                        ".jpg",
-                        ".jpeg",
-                        ".gif",
-                        ".zip",
-                        ".tar.gz",
-                        ".exe",
-                        ".dll",
-                        ".so",
-                        ".o",
-                        ".pyc",
-                        ".db-shm",
-                        ".db-wal",
-                    )
-                )
-            ):
+            if not _is_indexable(file, db_path):
                 logger.debug(f"Skipping file: {file}")
                 continue
+            yield os.path.join(root, file)
 
-            filepath = os.path.join(root, file)
-            logger.debug(f"Processing file: {filepath}")
 
+def _content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _embed_files(
+    idx: Index,
+    filepaths,
+    embed_fn,
+    batch_size,
+    workers,
+    max_batch_items,
+    max_batch_tokens,
+    max_retries,
+):
+    """
+    Runs the indexing pipeline over filepaths and returns (rows, files) where files maps
+    each indexed path to {"mtime", "content_hash", "poem_id", "row_ids", "complete"}.
+
+    The work is pipelined:
+      - a producer thread reads and parses files,
+      - a packer fills embedding requests across many poems up to max_batch_items / max_batch_tokens,
+      - up to `workers` embedding requests run concurrently (each retried with backoff),
+      - the calling thread is the single writer feeding Index.add_documents.
+    Bounded queues and a semaphore on in-flight requests provide backpressure.
+    """
+    files = {}
+    url_to_path = {}
+    failed_urls = set()
+    parsed = queue.Queue(maxsize=workers * 4)
+    embedded = queue.Queue(maxsize=workers * 2)
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    stop = threading.Event()
+    errors = []  # unexpected exceptions of the producer and packer threads, re-raised by the writer
+
+    def produce():
+        try:
+            read_files()
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            _put(parsed, None, stop)
+
+    def read_files():
+        for filepath in filepaths:
+            logger.debug(f"Processing file: {filepath}")
             content = read_file_content(filepath)
-            if content:
-                url, poem_id, verses = parse_file(content, file)
-                embeddings = get_embedding(verses)  # Whole file embedding for simplicity
-                if embeddings is not None:
-                    idx.add_document(url, verses, embeddings)
-                    indexed_count += 1
-                else:
-                    logger.warning(f"Could not generate embedding for {filepath}")
-            else:
+            if not content:
                 logger.warning(f"Could not read content from {filepath}")
+                continue
+            try:
+                url, poem_id, verses = parse_file(content, os.path.basename(filepath))
+            except Exception as e:  # a malformed file, e.g. too short for its header
+                logger.warning(f"Could not parse {filepath}: {e!r}")
+                continue
+            files[filepath] = {
+                "mtime": os.path.getmtime(filepath),
+                "content_hash": _content_hash(content),
+                "poem_id": poem_id,
+                "row_ids": [],
+                "complete": True,
+            }
+            url_to_path[url] = filepath
+            if verses and not _put(parsed, (url, verse_units(verses)), stop):
+                return
+
+    def embed_batch(batch):
+        try:
+            embeddings = _embed_with_retry(embed_fn, [text for _, _, text in batch], max_retries=max_retries)
+            if embeddings is None:
+                failed_urls.update(url for url, _, _ in batch)
+            else:
+                _put(embedded, (batch, embeddings), stop)
+        finally:
+            in_flight.release()
+
+    def pack(executor):
+        try:
+            pack_batches(executor)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            _put(embedded, None, stop)
+
+    def pack_batches(executor):
+        futures = []
+        batch, batch_tokens = [], 0
+
+        def submit():
+            in_flight.acquire()  # blocks while too many requests are outstanding
+            futures.append(executor.submit(embed_batch, batch))
+
+        while (item := _get(parsed, stop)) is not None:
+            url, units = item
+            for position, text in units:
+                tokens = estimate_tokens(text)
+                if batch and (len(batch) >= max_batch_items or batch_tokens + tokens > max_batch_tokens):
+                    submit()
+                    batch, batch_tokens = [], 0
+                batch.append((url, position, text))
+                batch_tokens += tokens
+        if batch:
+            submit()
+        for future in futures:
+            future.result()
+
+    def iter_documents():
+        while (item := embedded.get()) is not None:
+            batch, embeddings = item
+            # Regroup the packed batch into per-poem documents, preserving verse order.
+            for url, group in groupby(zip(batch, embeddings, strict=True), key=lambda pair: pair[0][0]):
+                group = list(group)
+                yield (
+                    url,
+                    [text for (_, _, text), _ in group],
+                    [vector for _, vector in group],
+                    [position for (_, position, _), _ in group],
+                )
 
+    row_ids = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as executor:
+        producer = threading.Thread(target=produce, name="index-producer", daemon=True)
+        packer = threading.Thread(target=pack, args=(executor,), name="index-packer", daemon=True)
+        producer.start()
+        packer.start()
+        try:
+            rows = idx.add_documents(iter_documents(), batch_size=batch_size, row_ids=row_ids)
+        except BaseException:
+            stop.set()
+            raise
+        producer.join()
+        packer.join()
+    if errors:
+        raise errors[0]
+
+    for url, filepath in url_to_path.items():
+        files[filepath]["row_ids"] = row_ids.get(url, [])
+        files[filepath]["complete"] = url not in failed_urls
+    if failed_urls:
+        logger.warning(
+            f"Embedding failed for {len(failed_urls)} documents; they will be retried on the next run."
+        )
+    return rows, files
+
+
+def index_directory(
+    directory_path,
+    index_instance: Index = None,
+    incremental=False,
+    batch_size=INDEX_BATCH_SIZE,
+    embed_fn=get_embedding,
+    workers=EMBEDDING_WORKERS,
+    max_batch_items=EMBEDDING_BATCH_ITEMS,
+    max_batch_tokens=EMBEDDING_BATCH_TOKENS,
+    max_retries=EMBEDDING_MAX_RETRIES,
+):
+    """
+    Walks a directory, embeds every verse and stores vectors in the given index instance.
+
+    Every indexed file is recorded in the index manifest (path, mtime, content hash, poem_id, row ids).
+    With incremental=True only files that were added or whose content hash changed are re-embedded;
+    rows of changed and removed files are deleted first. Files whose mtime matches the manifest are
+    not even read, so a no-op reindex costs one stat per file.
+
+    embed_fn takes a list of texts and returns a list of vectors (or None on failure),
+    e.g. get_embedding or an embeddings.EmbeddingProvider such as HashingEmbedder for offline runs.
+    The provider's name and dimension are recorded in the index; adding vectors of another
+    provider to a non-empty index raises ValueError.
+    """
+    if index_instance is None:
+        idx = Index()
+    else:
+        idx = index_instance
+    provider = embed_fn if isinstance(embed_fn, EmbeddingProvider) else get_embedding_provider()
+    idx.set_embedding_provider(provider.name, provider.dim)
+    mode = "incremental" if incremental else "full"
+    logger.info(
+        f"Starting {mode} indexing for directory: {directory_path} into {idx.db_path}/{idx.table_name}"
+    )
+    start = time.perf_counter()
+
+    filepaths = list(_iter_files(directory_path, idx.db_path))
+    manifest = idx.get_manifest() if incremental else {}
+    to_index = []
+    stale_row_ids = []
+    touched = []
+    for filepath in filepaths:
+        entry = manifest.get(filepath)
+        if entry is None:
+            to_index.append(filepath)
+            continue
+        mtime = os.path.getmtime(filepath)
+        # an empty hash marks a file whose embedding failed; it is retried whatever its mtime
+        if mtime == entry["mtime"] and entry["content_hash"]:
+            continue
+        content = read_file_content(filepath)
+        if content is not None and _content_hash(content) == entry["content_hash"]:
+            touched.append((filepath, mtime, entry["content_hash"], entry["poem_id"], entry["row_ids"]))
+            continue
+        to_index.append(filepath)
+        stale_row_ids.extend(entry["row_ids"])
+    removed = manifest.keys() - set(filepaths)
+    for filepath in removed:
+        stale_row_ids.extend(manifest[filepath]["row_ids"])
+
+    if stale_row_ids:
+        idx.delete_rows(stale_row_ids)
+    # Deleted row ids are handed out again to new rows, so no entry may keep them: changed files get
+    # theirs back once they are embedded again, and one that no longer reads or parses stays out.
+    changed = [filepath for filepath in to_index if filepath in manifest]
+    if removed or changed:
+        idx.delete_manifest([*removed, *changed])
+    if touched:
+        idx.upsert_manifest(touched)
+
+    rows = 0
+    if to_index:
+        rows, files = _embed_files(
+            idx, to_index, embed_fn, batch_size, workers, max_batch_items, max_batch_tokens, max_retries
+        )
+        idx.upsert_manifest(
+            # An empty hash and mtime force incomplete files to be re-embedded (and their partial rows
+            # replaced) on the next run.
+            (path, f["mtime"], f["content_hash"], f["poem_id"], f["row_ids"])
+            if f["complete"]
+            else (path, 0.0, "", f["poem_id"], f["row_ids"])
+            for path, f in files.items()
+        )
+
+    elapsed = time.perf_counter() - start
+    rate = rows / elapsed if elapsed else 0.0
     logger.info(
-        f"Finished indexing directory: {directory_path}. Processed {file_count} files, indexed {indexed_count} documents."
+        f"Finished {mode} indexing of {directory_path}: {len(filepaths)} files, {len(to_index)} (re)indexed, "
+        f"{len(removed)} removed, {rows} rows in {elapsed:.2f}s ({rate:.1f} rows/sec)."
     )
-    # No explicit save needed as add_document commits to SQLite.
+    return rows
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the semantic index of every collection.")
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="delete the database files of the selected collections (with any other collection stored in them) "
+        "and re-embed every poem",
+    )
+    parser.add_argument(
+        "--collection", choices=sorted(COLLECTIONS), action="append", help="index only these collections"
+    )
+    parser.add_argument(
+        "--train-ivf",
+        action="store_true",
+        help="(re)train the IVF approximate index after indexing (ANN_INDEX)",
+    )
+    parser.add_argument("--ivf-lists", type=int, default=None, help="IVF lists; default about 4 * sqrt(rows)")
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
     logger.info("Running semantic search tool with sqlite-vec...")
-
-    db_file = DB_PATH
-    table = TABLE_NAME
-
-    # Clean up old DB file for a fresh test run if it exists
-    if os.path.exists(db_file):
-        logger.info(f"Removing existing test database: {db_file}")
-        os.remove(db_file)
-    if os.path.exists(f"{db_file}-shm"):  # SQLite temporary files
-        os.remove(f"{db_file}-shm")
-    if os.path.exists(f"{db_file}-wal"):
-        os.remove(f"{db_file}-wal")
-
-    sample_docs_dir = "docs"
-    if not os.path.exists(sample_docs_dir):
-        raise FileNotFoundError(f"Directory {sample_docs_dir} not found")
-
-    custom_index = Index()
-
-    logger.info(f"Indexing '{sample_docs_dir}/' into {db_file}/{table}")
-    index_directory(sample_docs_dir, index_instance=custom_index)
-
-    # 7. Perform a search
-    search_query = "شمع"
-    logger.info(f"Performing search: '{search_query}'")
-    search_results = semantic_search_tool(query=search_query, top_k=2, index_instance=custom_index)
-
-    if search_results:
-        logger.info("Search results:")
-        for result in search_results:
-            # Ensure score is float for formatting. It should be.
-            score = float(result.get("score", 0.0))
-            logger.info(f"  File: {result['url']}")
-            logger.info(f"  Score: {score:.4f} (higher is better, 1-distance)")
-            logger.info(f"  Chunk: '{result['verse']}'")
-            logger.info("-" * 20)
-    else:
-        logger.info("No results found.")
-
-    del custom_index
+    collections = {name: COLLECTIONS[name] for name in args.collection or COLLECTIONS}
+
+    if args.rebuild:
+        for db_file in {collection["db_path"] for collection in collections.values()}:
+            # Clean up old DB file for a fresh run if it exists
+            if os.path.exists(db_file):
+                logger.info(f"Removing existing database: {db_file}")
+                os.remove(db_file)
+            if os.path.exists(f"{db_file}-shm"):  # SQLite temporary files
+                os.remove(f"{db_file}-shm")
+            if os.path.exists(f"{db_file}-wal"):
+                os.remove(f"{db_file}-wal")
+
+    for name, collection in collections.items():
+        docs_dir, db_file, table = collection["docs_dir"], collection["db_path"], collection["table_name"]
+        if not os.path.exists(docs_dir):
+            raise FileNotFoundError(f"Directory {docs_dir} of collection {name} not found")
+
+        custom_index = Index(db_file, table, dim=get_embedding_provider().dim)
+
+        logger.info(f"Indexing collection {name} from '{docs_dir}/' into {db_file}/{table}")
+        index_directory(docs_dir, index_instance=custom_index, incremental=not args.rebuild)
+        if args.train_ivf:
+            custom_index.train_ivf(n_lists=args.ivf_lists)
+        logger.info(f"Embedding cache: {get_embedding_cache().stats()}")
+
+        # 7. Perform a search
+        search_query = "شمع"
+        logger.info(f"Performing search: '{search_query}'")
+        search_results = semantic_search_tool(queries=[search_query], top_k=2, index_instance=custom_index)
+
+        if search_results:
+            logger.info("Search results:")
+            for result in search_results:
+                # Ensure score is float for formatting. It should be.
+                score = float(result.get("score", 0.0))
+                logger.info(f"  File: {result['url']}")
+                logger.info(f"  Score: {score:.4f} (cosine similarity, higher is better)")
+                logger.info(f"  Chunk: '{result['verse']}'")
+                logger.info("-" * 20)
+        else:
+            logger.info("No results found.")
+
+        del custom_index
 
     logger.info("index job finished")
@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from settings import DB_PATH, NUMPY_INDEX_PATH, TABLE_NAME
+from sqlite_helper import Index, get_index_pool, poem_number
+
+logger = logging.getLogger(__name__)
+
+
+class NumpyIndex:
+    """
+    In-memory search backend: a memory-mapped, contiguous matrix of L2-normalized float32
+    vectors plus parallel url/verse arrays, exported from the SQLite index.
+    Queries are one matrix-vector product and an argpartition top-k; search() returns the
+    same list of {"url", "verse", "score"} dicts as Index.search.
+    """
+
+    def __init__(self, matrix_path=NUMPY_INDEX_PATH, lexical_index=None):
+        self.matrix_path = matrix_path
+        # SQLite index (or pool) that answers lexical_search, which has no NumPy counterpart
+        self.lexical_index = lexical_index
+        self.meta_path = f"{os.path.splitext(matrix_path)[0]}.meta.json"
+        self.matrix = np.load(self.matrix_path, mmap_mode="r")
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.urls = meta["urls"]
+        self.verses = meta["verses"]
+        self.poem_ids = np.array([poem_number(url) for url in self.urls])
+        self._version = meta.get("version", "0")
+        logger.info(f"Loaded {self.matrix.shape[0]} vectors from {self.matrix_path}.")
+
+    @staticmethod
+    def build(index: Index, matrix_path=NUMPY_INDEX_PATH, lexical_index=None):
+        """Exports every beyt row of the SQLite index into matrix_path (+ .meta.json) and returns a NumpyIndex on it."""
+        rows = index.conn.execute(
+            f"SELECT url, verse, embedding FROM {index.table_name} WHERE hemistich = 0 ORDER BY rowid;"
+        ).fetchall()
+        matrix = np.empty((len(rows), index.dim), dtype=np.float32)
+        for i, (_, _, blob) in enumerate(rows):
+            matrix[i] = np.frombuffer(blob, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        # written aside and renamed into place, so a NumpyIndex still memory-mapping the old matrix keeps it
+        with open(f"{matrix_path}.tmp", "wb") as f:
+            np.save(f, matrix)
+        meta_path = f"{os.path.splitext(matrix_path)[0]}.meta.json"
+        with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": index.version(), "urls": [r[0] for r in rows], "verses": [r[1] for r in rows]},
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(f"{matrix_path}.tmp", matrix_path)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        logger.info(f"Exported {len(rows)} vectors from {index.db_path}/{index.table_name} to {matrix_path}.")
+        return NumpyIndex(matrix_path, lexical_index)
+
+    def version(self):
+        """Version of the SQLite index this matrix was exported from."""
+        return self._version
+
+    def warmup(self):
+        """Reads the whole memory-mapped matrix once so the first query does not fault its pages in."""
+        float(self.matrix.sum())
+        return self
+
+    def _results(self, scores, top_k, mask=None):
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+            top_k = min(top_k, int(mask.sum()))
+        top_k = min(top_k, scores.shape[0])
+        if top_k <= 0:
+            return []
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [{"url": self.urls[i], "verse": self.verses[i], "score": float(scores[i])} for i in top]
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _mask(self, poem_range):
+        """Boolean row mask of a (first, last) poem id range, or None for no filter."""
+        if poem_range is None:
+            return None
+        first, last = poem_range
+        return (self.poem_ids >= first) & (self.poem_ids <= last)
+
+    def search(self, query_vector, top_k=3, poem_range=None):
+        """Returns the top_k most similar verses by cosine similarity."""
+        if query_vector is None:
+            logger.warning("Search query vector is None. Returning empty results.")
+            return []
+        scores = self.matrix @ self._normalize(query_vector)
+        return self._results(scores, top_k, self._mask(poem_range))
+
+    def lexical_search(self, query, top_k=3, phrase=False, poem_range=None):
+        if self.lexical_index is None:
+            return []
+        return self.lexical_index.lexical_search(query, top_k=top_k, phrase=phrase, poem_range=poem_range)
+
+    def search_batch(self, query_vectors, top_k=3, poem_range=None):
+        """Searches many queries with a single matrix-matrix product; returns one result list per query."""
+        if not len(query_vectors):
+            return []
+        scores = self._normalize(query_vectors) @ self.matrix.T
+        mask = self._mask(poem_range)
+        return [self._results(row, top_k, mask) for row in scores]
+
+
+class SyncedNumpyIndex:
+    """
+    NumpyIndex of a SQLite index that stays in sync with it: every access compares the SQLite index
+    version with the one the matrix was exported at, and re-exports the matrix when they differ (e.g.
+    after a reindex). version() is the version of the matrix being served, so result caches keyed by
+    it are invalidated exactly when the served vectors change. Exposes the same methods as NumpyIndex.
+    """
+
+    def __init__(self, db_path=DB_PATH, table_name=TABLE_NAME, matrix_path=NUMPY_INDEX_PATH):
+        self.db_path = db_path
+        self.table_name = table_name
+        self.matrix_path = matrix_path
+        self.source = get_index_pool(db_path, table_name)  # also answers lexical_search
+        self._index = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the NumpyIndex of the current SQLite index version, loading or re-exporting it if needed."""
+        version = self.source.version()
+        index = self._index
+        if index is not None and index.version() == version:
+            return index
+        with self._lock:
+            if self._index is None and os.path.exists(self.matrix_path):
+                self._index = NumpyIndex(self.matrix_path, self.source)
+            if self._index is None or self._index.version() != version:
+                source = Index(self.db_path, self.table_name)
+                self._index = NumpyIndex.build(source, self.matrix_path, self.source)
+                source.conn.close()
+            return self._index
+
+    def warmup(self):
+        self.get().warmup()
+        return self
+
+    def version(self):
+        return self.get().version()
+
+    def search(self, query_vector, top_k=3, poem_range=None):
+        return self.get().search(query_vector, top_k=top_k, poem_range=poem_range)
+
+    def search_batch(self, query_vectors, top_k=3, poem_range=None):
+        return self.get().search_batch(query_vectors, top_k=top_k, poem_range=poem_range)
+
+    def lexical_search(self, query, top_k=3, phrase=False, poem_range=None):
+        return self.source.lexical_search(query, top_k=top_k, phrase=phrase, poem_range=poem_range)
+
+
+_numpy_indexes = {}
+_numpy_index_lock = threading.Lock()
+
+
+def get_numpy_index(db_path=DB_PATH, table_name=TABLE_NAME, matrix_path=NUMPY_INDEX_PATH):
+    """
+    Returns the process-wide SyncedNumpyIndex of matrix_path, which (re)exports the matrix from the
+    SQLite index whenever the matrix file is missing or the index has changed since.
+    """
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(
+            f"No SQLite index at {db_path} to export {matrix_path} from; run index.py first"
+        )
+    with _numpy_index_lock:
+        if matrix_path not in _numpy_indexes:
+            _numpy_indexes[matrix_path] = SyncedNumpyIndex(db_path, table_name, matrix_path)
+        return _numpy_indexes[matrix_path]
@@ -0,0 +1,19 @@
+import re
+
+# Arabic code points commonly found in Persian text, mapped to their Persian forms
+_CHAR_MAP = str.maketrans(
+    {
+        "ي": "ی",  # ARABIC YEH -> FARSI YEH
+        "ى": "ی",  # ALEF MAKSURA -> FARSI YEH
+        "ك": "ک",  # ARABIC KAF -> KEHEH
+        "‌": None,  # ZWNJ
+        "ـ": None,  # TATWEEL
+    }
+)
+# harakat, tanwin, shadda, sukun, superscript alef
+_DIACRITICS = re.compile("[ً-ٰٟ]")
+
+
+def normalize_persian(text):
+    """Normalizes Persian text for lexical matching: unified yeh/kaf, no ZWNJ, tatweel or diacritics."""
+    return " ".join(_DIACRITICS.sub("", text.translate(_CHAR_MAP)).split())
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Multi-session agent server: the REPL's conversation loop behind a local HTTP/JSON endpoint, on asyncio.
+
+    uv run python server.py --port 8765
+
+    POST   /sessions                  -> 201 {"session_id": ...}
+    POST   /sessions/<id>/messages    {"content": "..."} -> {"reply": ..., "tool_calls": [...], "latency_ms": ...}
+    DELETE /sessions/<id>             -> {"deleted": true}
+    GET    /stats                     -> sessions, queue and tool metrics, stage timings
+
+Every session has its own ConversationContext; all sessions share one ToolRegistry, whose tools
+search the shared read-only index pools. Model calls are awaited on the event loop, tool calls
+run on a bounded thread pool. At most SERVER_MAX_CONCURRENT_TURNS turns run at once, up to
+SERVER_QUEUE_SIZE more wait for a slot, and further messages are rejected with 503.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from agent import DEVELOPER_MESSAGE, build_registry
+from clients import get_async_openai_client
+from conversation import ConversationContext
+from settings import (
+    CHAT_MODEL,
+    SERVER_HOST,
+    SERVER_MAX_CONCURRENT_TURNS,
+    SERVER_MAX_SESSIONS,
+    SERVER_MAX_TOOL_ROUNDS,
+    SERVER_PORT,
+    SERVER_QUEUE_SIZE,
+    SERVER_SESSION_TTL,
+    SERVER_TOOL_WORKERS,
+)
+from timing import get_stage_timer, span
+
+logger = logging.getLogger(__name__)
+
+_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.context = ConversationContext(DEVELOPER_MESSAGE)
+        self.lock = asyncio.Lock()  # one turn at a time per conversation
+        self.last_used = time.monotonic()
+
+
+class AgentServer:
+    """
+    Serves conversations over HTTP/JSON. llm is an AsyncOpenAI client or anything with an awaitable
+    `responses.create` (e.g. the stub of benchmarks.server_load); it defaults to the shared async client.
+    """
+
+    def __init__(
+        self,
+        registry=None,
+        llm=None,
+        max_sessions=SERVER_MAX_SESSIONS,
+        session_ttl=SERVER_SESSION_TTL,
+        max_concurrent_turns=SERVER_MAX_CONCURRENT_TURNS,
+        queue_size=SERVER_QUEUE_SIZE,
+        tool_workers=SERVER_TOOL_WORKERS,
+        max_tool_rounds=SERVER_MAX_TOOL_ROUNDS,
+    ):
+        self.registry = registry or build_registry()
+        self.llm = llm
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.queue_size = queue_size
+        self.max_tool_rounds = max_tool_rounds
+        self.executor = ThreadPoolExecutor(max_workers=tool_workers, thread_name_prefix="server-tool")
+        self.sessions = {}
+        self._turn_slots = asyncio.Semaphore(max_concurrent_turns)
+        self.max_concurrent_turns = max_concurrent_turns
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self.turns = 0
+
+    async def start(self, host=SERVER_HOST, port=SERVER_PORT):
+        """Loads the tools and indexes, then listens; returns the asyncio server."""
+        if self.llm is None:
+            self.llm = get_async_openai_client()
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.registry.warmup)
+        server = await asyncio.start_server(self._handle, host, port)
+        logger.info(f"Agent server listening on {', '.join(str(s.getsockname()) for s in server.sockets)}")
+        return server
+
+    # --- sessions ---
+
+    def _expire_sessions(self):
+        cutoff = time.monotonic() - self.session_ttl
+        for session_id in [
+            s.id for s in self.sessions.values() if s.last_used < cutoff and not s.lock.locked()
+        ]:
+            del self.sessions[session_id]
+
+    def create_session(self):
+        self._expire_sessions()
+        if len(self.sessions) >= self.max_sessions:
+            raise HTTPError(503, "too many sessions")
+        session = Session(uuid.uuid4().hex)
+        self.sessions[session.id] = session
+        return session
+
+    def get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPError(404, f"unknown session {session_id}")
+        session.last_used = time.monotonic()
+        return session
+
+    # --- turns ---
+
+    async def handle_message(self, session, content):
+        """Runs one user message through the model and tools, waiting for a turn slot first."""
+        if self.queued >= self.queue_size:
+            self.rejected += 1
+            raise HTTPError(503, "server busy, try again later")
+        start = time.perf_counter()
+        # waiting for the session's previous turn counts against the queue as well as waiting for a slot
+        self.queued += 1
+        try:
+            await session.lock.acquire()
+            try:
+                await self._turn_slots.acquire()
+            except BaseException:
+                session.lock.release()
+                raise
+        finally:
+            self.queued -= 1
+        self.active += 1
+        checkpoint = session.context.checkpoint()
+        try:
+            reply, tool_calls = await self._run_turn(session, content)
+        except BaseException:
+            # a failed turn leaves nothing behind, e.g. a user message without a reply
+            session.context.restore(checkpoint)
+            raise
+        finally:
+            self.active -= 1
+            self._turn_slots.release()
+            session.lock.release()
+        self.turns += 1
+        return {"reply": reply, "tool_calls": tool_calls, "latency_ms": (time.perf_counter() - start) * 1000}
+
+    async def _call_tool(self, tool_call):
+        try:
+            arg = json.loads(tool_call.arguments)
+        except ValueError as e:
+            return {"error": f"invalid arguments for tool {tool_call.name}: {e}"}
+        return await self.registry.run_async(tool_call.name, arg, self.executor)
+
+    async def _run_turn(self, session, content):
+        """
+        The REPL loop of agent.main for one message: the model is called again with the tool outputs
+        until it answers without tool calls, at most max_tool_rounds times.
+        Returns (reply, names of the tools called).
+        """
+        context = session.context
+        context.append({"role": "user", "content": content})
+        tool_names = []
+        reply = ""
+        for _ in range(self.max_tool_rounds):
+            with span("model"):
+                response = await self.llm.responses.create(
+                    model=CHAT_MODEL, input=context.messages, tools=self.registry.get_tools()
+                )
+            reply = response.output_text
+            if reply:
+                context.append({"role": "assistant", "content": reply})
+            tool_calls = [item for item in response.output if item.type == "function_call"]
+            if not tool_calls:
+                return reply, tool_names
+            outputs = await asyncio.gather(*(self._call_tool(tool_call) for tool_call in tool_calls))
+            for tool_call, output in zip(tool_calls, outputs, strict=True):
+                context.add_tool_result(
+                    tool_call, output, encoder=partial(self.registry.encode, tool_call.name)
+                )
+                tool_names.append(tool_call.name)
+        logger.warning(f"Session {session.id} hit {self.max_tool_rounds} tool rounds without a final answer")
+        return reply, tool_names
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "active_turns": self.active,
+            "queued_turns": self.queued,
+            "max_concurrent_turns": self.max_concurrent_turns,
+            "turns": self.turns,
+            "rejected": self.rejected,
+            "tools": self.registry.metrics(),
+            "stages": get_stage_timer().stats(),
+        }
+
+    # --- HTTP ---
+
+    async def _route(self, method, path, body):
+        parts = [part for part in path.split("?")[0].split("/") if part]
+        match method, parts:
+            case "POST", ["sessions"]:
+                return 201, {"session_id": self.create_session().id}
+            case "POST", ["sessions", session_id, "messages"]:
+                session = self.get_session(session_id)
+                try:
+                    content = json.loads(body or b"{}")["content"]
+                except (ValueError, KeyError, TypeError):
+                    raise HTTPError(400, 'expected a JSON body {"content": "..."}') from None
+                if not isinstance(content, str) or not content.strip():
+                    raise HTTPError(400, "content must be a non-empty string")
+                return 200, await self.handle_message(session, content)
+            case "DELETE", ["sessions", session_id]:
+                self.get_session(session_id)
+                del self.sessions[session_id]
+                return 200, {"deleted": True}
+            case "GET", ["stats"]:
+                return 200, self.stats()
+        raise HTTPError(404, f"no route for {method} {path}")
+
+    async def _handle(self, reader, writer):
+        """Serves one request per connection (HTTP/1.1 with Connection: close)."""
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            status, payload = await self._route(method.upper(), path, body)
+        except HTTPError as e:
+            status, payload = e.status, {"error": str(e)}
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, payload = 400, {"error": f"malformed request: {e}"}
+        except Exception as e:
+            logger.exception(f"Error serving request: {e}")
+            status, payload = 500, {"error": "internal error"}
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, 'Internal Server Error')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n"
+        )
+        try:
+            writer.write(head.encode("latin-1") + data)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host, port):
+    server = await AgentServer().start(host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(message)s")
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -11,20 +11,101 @@ OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable not set.")
 
-# text-embedding-3-small
-# text-embedding-3-large
-EMBEDDING_MODEL = "text-embedding-3-small"
+# embedding provider: an OpenAI model (text-embedding-3-small, text-embedding-3-large),
+# "hashing" (deterministic, offline) or "local:<sentence-transformers model>" (CPU inference,
+# e.g. "local:paraphrase-multilingual-MiniLM-L12-v2", whose vectors have 384 dimensions)
+# or "recorded:<model>" (replays <model>'s vectors from the embedding cache, without network access);
+# the EMBEDDING_MODEL environment variable overrides it
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
+# dimension of the vector table; must match the provider
 EMBEDDING_DIM = 1536
+# texts per inference batch and inference threads of the local provider
+LOCAL_EMBEDDING_BATCH_SIZE = 64
+LOCAL_EMBEDDING_WORKERS = 2
 
 # other possible o4-mini
 CHAT_MODEL = "gpt-4.1-mini"
+# stream chat responses token by token in the REPL
+STREAM_RESPONSES = True
+# estimated prompt tokens above which older tool outputs are compacted and old exchanges dropped
+CONTEXT_TOKEN_BUDGET = 12_000
+
+# common prefix of poem URLs, stripped from tool outputs sent to the model
+POEM_BASE_URL = "https://ganjoor.net/hafez/ghazal/"
 
 DB_PATH = "semantic_index.db"
+# search backend for semantic_search_tool: "sqlite" (sqlite-vec KNN) or "numpy" (in-memory matrix exported from sqlite)
+SEARCH_BACKEND = "sqlite"
+NUMPY_INDEX_PATH = "semantic_index.npy"
+# "semantic" (vector only) or "hybrid" (vector + FTS5 BM25 over normalized verses, fused by rank)
+SEARCH_MODE = "hybrid"
+# in hybrid mode, queries of at least this many words with an exact-phrase hit skip the embedding call
+LEXICAL_FAST_PATH_MIN_WORDS = 3
+# per-query search result cache (LRU + TTL); set RESULT_CACHE_PATH to persist it on disk
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 24 * 3600
+RESULT_CACHE_PATH = None
+# rank offset of reciprocal-rank fusion when merging results of several queries
+RRF_K = 60
+# coarse vectors for a cheaper first KNN pass: "float32" (no coarse pass), "int8" or "bit";
+# coarse hits are rescored against the full-precision vectors
+VECTOR_STORAGE = "float32"
+# Matryoshka-style truncation of coarse vectors (text-embedding-3 supports e.g. 256 or 512); None keeps EMBEDDING_DIM
+VECTOR_COARSE_DIM = None
+# coarse candidates fetched per requested result before rescoring
+RESCORE_FACTOR = 8
+# approximate nearest-neighbour search for large corpora: None (exact scan) or "ivf" (k-means inverted
+# lists stored as vec0 partitions, trained with `python index.py --train-ivf`); once trained, the
+# lists follow inserts and deletes
+ANN_INDEX = None
+# inverted lists scanned per query; more probes raise recall and latency
+IVF_PROBES = 8
 TABLE_NAME = "embeddings_vec"
+# named collections (shards), e.g. one per poet/form, each in its own vec0 table and optionally its own
+# database file; searches fan out over the collections matching the poet/form filter and merge the top-k
+COLLECTIONS = {
+    "hafez-ghazal": {
+        "poet": "hafez",
+        "form": "ghazal",
+        "docs_dir": "docs",
+        "db_path": DB_PATH,
+        "table_name": TABLE_NAME,
+        "numpy_path": NUMPY_INDEX_PATH,
+    },
+}
+# threads querying shards in parallel
+SHARD_WORKERS = 4
+# pragmas for read-only search connections
+READ_MMAP_SIZE = 256 * 1024 * 1024
+READ_CACHE_SIZE_KB = 64 * 1024
+# rows written per transaction during bulk ingestion
+INDEX_BATCH_SIZE = 500
+# also embed each half of a beyt (split at " / ") as its own row, for hemistich-level matches.
+# Off by default: hemistich rows share the vector table, so they triple its rows and the embedding
+# calls of a rebuild, grow the database about 2.7x, and roughly double beyt search latency
+# (the hemistich = 0 filter runs over the full scan). Rebuild the index after changing it.
+INDEX_HEMISTICHS = False
+# embedding request packing and concurrency for the indexing pipeline
+EMBEDDING_BATCH_ITEMS = 512
+EMBEDDING_BATCH_TOKENS = 50_000
+EMBEDDING_WORKERS = 4
+EMBEDDING_MAX_RETRIES = 3
 
-LOGFIRE_API_KEY = os.environ.get("LOGFIRE_API_KEY")
-if LOGFIRE_API_KEY:
-    import logfire
+# on-disk embedding cache shared by indexing and search, with an in-process LRU on top
+EMBEDDING_CACHE_PATH = "embedding_cache.db"
+EMBEDDING_CACHE_SIZE = 10_000
 
-    logfire.configure(token=LOGFIRE_API_KEY, console=False)
-    logfire.instrument_openai()
+# asyncio agent server (server.py): listen address, live sessions and their idle expiry (seconds)
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+SERVER_MAX_SESSIONS = 1000
+SERVER_SESSION_TTL = 3600
+# turns running at once, turns waiting for a slot before requests are rejected with 503,
+# threads running tool calls, and model/tool rounds per user message
+SERVER_MAX_CONCURRENT_TURNS = 32
+SERVER_QUEUE_SIZE = 256
+SERVER_TOOL_WORKERS = 8
+SERVER_MAX_TOOL_ROUNDS = 5
+
+# traces OpenAI calls to logfire when set; configured with the first OpenAI client (clients.py)
+LOGFIRE_API_KEY = os.environ.get("LOGFIRE_API_KEY")
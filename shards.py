@@ -0,0 +1,109 @@
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from settings import COLLECTIONS, SEARCH_BACKEND, SHARD_WORKERS
+from sqlite_helper import get_index_pool
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedIndex:
+    """
+    Search over named collections (shards), each with its own search backend (an IndexPool or SyncedNumpyIndex).
+    poet/form filters select the shards to query, and poem_range is pushed down into every shard's query.
+    Queries fan out over the selected shards on a thread pool and the per-shard top-k lists are merged
+    with a heap. Exposes the same search methods as IndexPool; every hit is tagged with its 'collection'.
+    """
+
+    def __init__(self, shards, collections=COLLECTIONS, max_workers=SHARD_WORKERS):
+        self.shards = shards  # collection name -> search backend
+        self.collections = collections
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard")
+
+    def select(self, poet=None, form=None):
+        """Names of the collections matching the poet and form filters (None matches any)."""
+        return [
+            name
+            for name in self.shards
+            if (poet is None or self.collections[name]["poet"] == poet)
+            and (form is None or self.collections[name]["form"] == form)
+        ]
+
+    def _fan_out(self, names, fn):
+        """Returns [fn(shard) for each named shard], querying the shards in parallel."""
+        if len(names) == 1:
+            return [fn(self.shards[names[0]])]  # no thread hop for a single shard
+        return list(self._executor.map(lambda name: fn(self.shards[name]), names))
+
+    @staticmethod
+    def _merge(names, result_lists, top_k, key=lambda hit: hit["score"]):
+        tagged = (
+            {**hit, "collection": name}
+            for name, results in zip(names, result_lists, strict=True)
+            for hit in results
+        )
+        return heapq.nlargest(top_k, tagged, key=key)
+
+    def search(self, query_vector, top_k=3, poem_range=None, poet=None, form=None):
+        return self.search_batch([query_vector], top_k=top_k, poem_range=poem_range, poet=poet, form=form)[0]
+
+    def search_batch(self, query_vectors, top_k=3, poem_range=None, poet=None, form=None):
+        """Searches every query on all selected shards; returns one merged top_k list per query."""
+        names = self.select(poet, form)
+        per_shard = self._fan_out(
+            names, lambda shard: shard.search_batch(query_vectors, top_k=top_k, poem_range=poem_range)
+        )
+        return [
+            self._merge(names, [results[i] for results in per_shard], top_k)
+            for i in range(len(query_vectors))
+        ]
+
+    def lexical_search(self, query, top_k=3, phrase=False, poem_range=None, poet=None, form=None):
+        names = self.select(poet, form)
+        per_shard = self._fan_out(
+            names,
+            lambda shard: shard.lexical_search(query, top_k=top_k, phrase=phrase, poem_range=poem_range),
+        )
+        return self._merge(names, per_shard, top_k)
+
+    def search_poems(self, query_vector, top_poems=3, top_k=3, poet=None, form=None):
+        names = self.select(poet, form)
+        per_shard = self._fan_out(
+            names, lambda shard: shard.search_poems(query_vector, top_poems=top_poems, top_k=top_k)
+        )
+        return self._merge(names, per_shard, top_poems)
+
+    def version(self):
+        """Combined version of all shards; changes whenever any shard changes."""
+        return "-".join(f"{name}:{self.shards[name].version()}" for name in sorted(self.shards))
+
+    def warmup(self):
+        for name, shard in self.shards.items():
+            shard.warmup()
+            logger.info(f"Shard '{name}' ready.")
+        return self
+
+
+_sharded_indexes = {}
+_sharded_indexes_lock = threading.Lock()
+
+
+def get_sharded_index(backend=SEARCH_BACKEND):
+    """Returns the process-wide ShardedIndex over settings.COLLECTIONS for a search backend ("sqlite" or "numpy")."""
+    with _sharded_indexes_lock:
+        if backend not in _sharded_indexes:
+            if backend == "numpy":
+                from numpy_index import get_numpy_index
+
+                shards = {
+                    name: get_numpy_index(c["db_path"], c["table_name"], c["numpy_path"])
+                    for name, c in COLLECTIONS.items()
+                }
+            else:
+                shards = {
+                    name: get_index_pool(c["db_path"], c["table_name"]) for name, c in COLLECTIONS.items()
+                }
+            _sharded_indexes[backend] = ShardedIndex(shards)
+        return _sharded_indexes[backend]
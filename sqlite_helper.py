@@ -1,28 +1,123 @@
+import heapq
 import json
 import logging
+import re
 import sqlite3
+import threading
+import time
+import uuid
+from array import array
+from contextlib import contextmanager
+from itertools import batched, count
 
-import sqlite_vec  # Added for sqlite-vec
-from sqlite_vec import serialize_float32
-
-from settings import DB_PATH, EMBEDDING_DIM, TABLE_NAME
+from embeddings import get_embedding_provider
+from persian import normalize_persian
+from settings import (
+    ANN_INDEX,
+    DB_PATH,
+    INDEX_BATCH_SIZE,
+    IVF_PROBES,
+    POEM_BASE_URL,
+    READ_CACHE_SIZE_KB,
+    READ_MMAP_SIZE,
+    RESCORE_FACTOR,
+    TABLE_NAME,
+    VECTOR_COARSE_DIM,
+    VECTOR_STORAGE,
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# column type and SQL expression turning a float32 vector (bound as ?) into a coarse vector of `dim` dimensions
+_COARSE_STORAGE = {
+    "int8": ("int8", "vec_quantize_int8(vec_normalize(vec_slice(?, 0, {dim})), 'unit')"),
+    "bit": ("bit", "vec_quantize_binary(vec_slice(?, 0, {dim}))"),
+}
+
+
+def serialize_float32(vector):
+    """Packs a vector into the float32 blob sqlite-vec expects (as sqlite_vec.serialize_float32)."""
+    return array("f", vector).tobytes()
+
+
+def poem_ref(url, base_url=POEM_BASE_URL):
+    """Short poem id of a poem URL, the URL minus base_url, e.g. "sh12" (the whole URL if it has another base)."""
+    return url[len(base_url) :].strip("/") if url.startswith(base_url) else url
+
+
+def poem_number(url):
+    """Integer poem id of a poem URL, e.g. 12 for https://ganjoor.net/hafez/ghazal/sh12/ (0 if it has none)."""
+    match = re.search(r"/sh(\d+)/?$", url or "")
+    return int(match.group(1)) if match else 0
+
 
 class Index:
-    """Stores and manages document embeddings using sqlite-vec."""
+    """
+    Stores and manages document embeddings using sqlite-vec.
+    dim defaults to the dimension recorded in the database (or of its vector table), and for a new
+    database to that of the configured embedding provider.
+    """
+
+    def __init__(
+        self,
+        db_path=DB_PATH,
+        table_name=TABLE_NAME,
+        read_only=False,
+        storage=VECTOR_STORAGE,
+        coarse_dim=VECTOR_COARSE_DIM,
+        rescore_factor=RESCORE_FACTOR,
+        dim=None,
+        ann=ANN_INDEX,
+        probes=IVF_PROBES,
+    ):
+        self.db_path = db_path
+        self.table_name = table_name
+        self.manifest_table = f"{table_name}_manifest"
+        self.meta_table = f"{table_name}_meta"
+        # FTS5 index over normalized verses for lexical (BM25) search
+        self.fts_table = f"{table_name}_fts"
+        # one centroid vector per poem (rowid = poem_id) for poem-level KNN
+        self.poem_table = f"{table_name}_poems"
+        if storage != "float32" and storage not in _COARSE_STORAGE:
+            raise ValueError(f"Unsupported vector storage: {storage}")
+        self.storage = storage
+        self.rescore_factor = rescore_factor
+        # Plain rowid table of full-precision vectors for rescoring: point reads from vec0 decode
+        # whole vector chunks and would cost more than the coarse pass saves.
+        self.rescore_table = f"{table_name}_rescore"
+        if ann not in (None, "ivf"):
+            raise ValueError(f"Unsupported ANN index: {ann}")
+        self.ann = ann
+        self.probes = probes
+        # IVF: vectors partitioned by their nearest k-means centroid (vec0 partition key = list id),
+        # so a query scans only the lists of its `probes` nearest centroids
+        self.ivf_table = f"{table_name}_ivf"
+        self.ivf_centroid_table = f"{table_name}_ivf_centroids"
+        self._ivf_centroids = None  # (list ids, centroid matrix), loaded on the first insert
+        self._in_transaction = False
+        self.read_only = read_only
+        if read_only:
+            # IndexPool confines each read-only connection to one thread but may close it from another.
+            self.conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            self.conn.execute(f"PRAGMA mmap_size={READ_MMAP_SIZE};")
+            self.conn.execute(f"PRAGMA cache_size=-{READ_CACHE_SIZE_KB};")
+        else:
+            self.conn = sqlite3.connect(self.db_path)
+        # imported here so that importing this module stays cheap for processes that never search
+        import sqlite_vec
 
-    def __init__(self):
-        self.db_path = DB_PATH
-        self.table_name = TABLE_NAME
-        self.conn = sqlite3.connect(self.db_path)
         self.conn.enable_load_extension(True)
         sqlite_vec.load(self.conn)
         self.conn.enable_load_extension(False)
+        self.conn.create_function("poem_number", 1, poem_number, deterministic=True)
         logger.info(f"Connected to SQLite database: {self.db_path} and loaded sqlite-vec extension.")
-        self._create_table()
+        self.dim = dim or self._stored_dim() or get_embedding_provider().dim
+        self.coarse_dim = min(coarse_dim or self.dim, self.dim)
+        # e.g. embeddings_vec_int8_256; one coarse table per storage/dimension so modes can coexist
+        self.coarse_table = None if storage == "float32" else f"{table_name}_{storage}_{self.coarse_dim}"
+        if not read_only:
+            self._create_table()
 
     def _execute_sql(self, sql, params=()):
         """Executes SQL and handles cursor management."""
@@ -36,85 +131,820 @@ class Index:
             # Optionally, re-raise or handle more gracefully
             raise
 
+    def _execute_many(self, sql, seq_of_params):
+        """Executes SQL for every parameter tuple in a single transaction (or in the enclosing transaction())."""
+        try:
+            if self._in_transaction:
+                return self.conn.executemany(sql, seq_of_params)
+            with self.conn:
+                cur = self.conn.executemany(sql, seq_of_params)
+            return cur
+        except Exception as e:
+            logger.error(f"SQLite error: {e} for SQL: {sql} with {len(seq_of_params)} rows")
+            raise
+
+    @contextmanager
+    def transaction(self):
+        """
+        Commits every _execute_many inside the block as one transaction, or rolls them all back, so
+        the vector table and its FTS, coarse, rescoring and IVF side tables never diverge.
+        """
+        if self._in_transaction:
+            yield
+            return
+        self._in_transaction = True
+        try:
+            with self.conn:
+                yield
+        finally:
+            self._in_transaction = False
+
+    @contextmanager
+    def bulk_load(self):
+        """
+        Tunes pragmas for bulk writes and restores the previous synchronous level afterwards.
+        In WAL mode synchronous=NORMAL only fsyncs at checkpoints: a power loss can drop the last
+        commits but never corrupts the database, which OFF could.
+        """
+        previous_synchronous = self.conn.execute("PRAGMA synchronous;").fetchone()[0]
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+        try:
+            yield self
+        finally:
+            self.conn.execute(f"PRAGMA synchronous={previous_synchronous};")
+
     def _create_table(self):
         """Creates the vector table if it doesn't exist."""
-        # Using f-string for table_name and EMBEDDING_DIM is generally safe here as they are controlled internally.
+        # Using f-string for table_name and dim is generally safe here as they are controlled internally.
         # However, for user-provided table names, parameterization or strict validation would be crucial.
-        sql = f"""
+        existing = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?;", (self.table_name,)
+        ).fetchone()
+        if existing is not None and (
+            "distance_metric=cosine" not in existing[0] or "poem_id" not in existing[0]
+        ):
+            self._migrate_table()
+        self._execute_sql(self._vec_table_sql())
+        if self.coarse_table:
+            self._create_coarse_table()
+        self._create_fts_table()
+        self._create_poem_table()
+        self._execute_sql(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.manifest_table} (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                content_hash TEXT NOT NULL,
+                poem_id TEXT,
+                row_ids TEXT NOT NULL  -- JSON list of rowids in the vector table
+            );
+            """
+        )
+        self._execute_sql(
+            f"CREATE TABLE IF NOT EXISTS {self.meta_table} (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+        )
+        logger.info(f"Table '{self.table_name}' ensured in {self.db_path}.")
+
+    def version(self):
+        """
+        Returns the index version, a token that changes whenever rows are added or deleted.
+        Unique across rebuilds, so caches keyed by it never serve results of an older index.
+        """
+        try:
+            row = self.conn.execute(f"SELECT value FROM {self.meta_table} WHERE key = 'version';").fetchone()
+        except sqlite3.OperationalError:  # read-only connection to a database without the meta table
+            return "0"
+        return row[0] if row else "0"
+
+    def _bump_version(self):
+        self._execute_sql(
+            f"INSERT OR REPLACE INTO {self.meta_table} (key, value) VALUES ('version', ?);",
+            (uuid.uuid4().hex,),
+        )
+
+    def embedding_provider(self):
+        """Returns (provider name, dim) recorded for the vectors of this index, or None if none was recorded."""
+        try:
+            rows = dict(
+                self.conn.execute(
+                    f"SELECT key, value FROM {self.meta_table} WHERE key IN ('embedding_provider', 'embedding_dim');"
+                ).fetchall()
+            )
+        except sqlite3.OperationalError:  # read-only connection to a database without the meta table
+            return None
+        if "embedding_provider" not in rows:
+            return None
+        return rows["embedding_provider"], int(rows["embedding_dim"])
+
+    def set_embedding_provider(self, name, dim):
+        """
+        Records which provider and dimension produce the vectors of this index.
+        Raises ValueError if the index already holds vectors of another provider or dimension,
+        since their similarities would be meaningless.
+        """
+        if dim != self.dim:
+            raise ValueError(
+                f"Provider {name} produces {dim}-dimensional vectors but {self.table_name} stores {self.dim}"
+            )
+        recorded = self.embedding_provider()
+        if recorded == (name, dim):
+            return
+        has_rows = self.conn.execute(f"SELECT 1 FROM {self.table_name} LIMIT 1;").fetchone() is not None
+        if recorded is not None and has_rows:
+            raise ValueError(
+                f"{self.db_path}/{self.table_name} was built with {recorded[0]} ({recorded[1]} dims), "
+                f"not {name} ({dim} dims); rebuild the index to switch providers"
+            )
+        self._execute_many(
+            f"INSERT OR REPLACE INTO {self.meta_table} (key, value) VALUES (?, ?);",
+            [("embedding_provider", name), ("embedding_dim", str(dim))],
+        )
+
+    def _stored_dim(self):
+        """Dimension recorded with the embedding provider, else that of an existing vector table, else None."""
+        recorded = self.embedding_provider()
+        if recorded is not None:
+            return recorded[1]
+        row = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?;", (self.table_name,)
+        ).fetchone()
+        match = re.search(r"embedding FLOAT\[(\d+)\]", row[0]) if row else None
+        return int(match.group(1)) if match else None
+
+    def _vec_table_sql(self):
+        return f"""
         CREATE VIRTUAL TABLE IF NOT EXISTS {self.table_name} USING vec0(
-            embedding FLOAT[{EMBEDDING_DIM}],  -- Define the vector column with its dimensions
+            embedding FLOAT[{self.dim}] distance_metric=cosine,  -- vector column with its dimensions and metric
             url TEXT,
             verse TEXT,
+            poem_id INTEGER,  -- e.g. 12 for .../ghazal/sh12/
+            beyt INTEGER,  -- 1-based beyt number within the poem
+            hemistich INTEGER,  -- 0 for a whole beyt, 1 or 2 for its first or second half
         );
         """
-        self._execute_sql(sql)
-        logger.info(f"Table '{self.table_name}' ensured in {self.db_path}.")
+
+    def _migrate_table(self):
+        """
+        Recreates a vector table from before cosine distance or the poem_id/beyt/hemistich columns.
+        vec0 tables cannot be altered or renamed, so rows are copied through a temp table, keeping rowids;
+        poem ids are derived from urls and beyts numbered in rowid order. Hemistich rows are only added
+        when a poem is re-embedded.
+        """
+        logger.info(f"Migrating '{self.table_name}' in {self.db_path} to the current schema.")
+        migrate_table = f"{self.table_name}_migrate"
+        try:
+            self.conn.execute("BEGIN;")
+            self.conn.execute(
+                f"CREATE TEMP TABLE {migrate_table} AS SELECT rowid AS id, embedding, url, verse FROM {self.table_name};"
+            )
+            self.conn.execute(f"DROP TABLE {self.table_name};")
+            self.conn.execute(self._vec_table_sql())
+            self.conn.execute(
+                f"""
+                INSERT INTO {self.table_name} (rowid, embedding, url, verse, poem_id, beyt, hemistich)
+                SELECT id, embedding, url, verse, poem_number(url), ROW_NUMBER() OVER (PARTITION BY url ORDER BY id), 0
+                FROM {migrate_table};
+                """
+            )
+            self.conn.execute(f"DROP TABLE {migrate_table};")
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Migration of {self.table_name} failed: {e}")
+            raise
+
+    def _coarse_expr(self, storage=None, coarse_dim=None):
+        return _COARSE_STORAGE[storage or self.storage][1].format(dim=coarse_dim or self.coarse_dim)
+
+    def _coarse_tables(self):
+        """
+        (table, storage, coarse_dim) of every coarse table in the database, whatever storage this
+        Index was opened with: writes must keep all of them in sync with the vector table.
+        """
+        pattern = re.compile(rf"{re.escape(self.table_name)}_({'|'.join(_COARSE_STORAGE)})_(\d+)")
+        return [
+            (name, match.group(1), int(match.group(2)))
+            for (name,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
+            if (match := pattern.fullmatch(name))
+        ]
+
+    def _table_exists(self, name):
+        row = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;", (name,)
+        ).fetchone()
+        return row is not None
+
+    def _create_coarse_table(self):
+        """Creates the coarse vector and rescoring tables, backfilling them from the vec0 table."""
+        if not self._table_exists(self.rescore_table):
+            self._execute_sql(
+                f"CREATE TABLE {self.rescore_table} (rowid INTEGER PRIMARY KEY, embedding BLOB NOT NULL);"
+            )
+            self._execute_sql(
+                f"INSERT INTO {self.rescore_table} (rowid, embedding) SELECT rowid, embedding FROM {self.table_name};"
+            )
+        existing = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?;", (self.coarse_table,)
+        ).fetchone()
+        if existing is not None:
+            if "hemistich" in existing[0]:
+                return
+            self._execute_sql(
+                f"DROP TABLE {self.coarse_table};"
+            )  # derived data, rebuilt with the hemistich column
+        column_type = _COARSE_STORAGE[self.storage][0]
+        metric = (
+            "" if self.storage == "bit" else " distance_metric=cosine"
+        )  # bit vectors only support hamming
+        self._execute_sql(
+            f"CREATE VIRTUAL TABLE {self.coarse_table} USING vec0("
+            f"embedding {column_type}[{self.coarse_dim}]{metric}, hemistich INTEGER);"
+        )
+        expr = self._coarse_expr().replace("?", "embedding")
+        self._execute_sql(
+            f"INSERT INTO {self.coarse_table} (rowid, embedding, hemistich) "
+            f"SELECT rowid, {expr}, hemistich FROM {self.table_name};"
+        )
+        logger.info(f"Coarse table '{self.coarse_table}' created in {self.db_path}.")
+
+    def _create_fts_table(self):
+        """Creates the FTS5 table and backfills it from the vector table."""
+        if self._table_exists(self.fts_table):
+            return
+        self._execute_sql(
+            f"CREATE VIRTUAL TABLE {self.fts_table} USING fts5(verse_norm, url UNINDEXED, verse UNINDEXED);"
+        )
+        rows = self.conn.execute(
+            f"SELECT rowid, url, verse FROM {self.table_name} WHERE hemistich = 0;"
+        ).fetchall()
+        if rows:
+            self._execute_many(
+                f"INSERT INTO {self.fts_table} (rowid, verse_norm, url, verse) VALUES (?, ?, ?, ?);",
+                [(rowid, normalize_persian(verse), url, verse) for rowid, url, verse in rows],
+            )
+        logger.info(f"FTS table '{self.fts_table}' created in {self.db_path}.")
+
+    def _create_poem_table(self):
+        """Creates the poem centroid table and backfills it from the beyt rows of the vector table."""
+        import numpy as np
+
+        if self._table_exists(self.poem_table):
+            return
+        self._execute_sql(
+            f"""
+            CREATE VIRTUAL TABLE {self.poem_table} USING vec0(
+                embedding FLOAT[{self.dim}] distance_metric=cosine,  -- normalized mean of the poem's beyt vectors
+                url TEXT,
+                beyts INTEGER,
+            );
+            """
+        )
+        sums = {}
+        for poem_id, url, blob in self.conn.execute(
+            f"SELECT poem_id, url, embedding FROM {self.table_name} WHERE hemistich = 0;"
+        ):
+            self._accumulate(sums, poem_id, url, np.frombuffer(blob, dtype=np.float32))
+        self._write_centroids(sums)
+        logger.info(f"Poem table '{self.poem_table}' created in {self.db_path}.")
+
+    @staticmethod
+    def _accumulate(sums, poem_id, url, vector):
+        entry = sums.get(poem_id)
+        if entry is None:
+            sums[poem_id] = [url, vector.astype("float64"), 1]
+        else:
+            entry[1] += vector
+            entry[2] += 1
+
+    def _write_centroids(self, sums):
+        """Replaces the centroids of the poems in sums ({poem_id: [url, vector sum, beyts]})."""
+        import numpy as np
+
+        if not sums:
+            return
+        rows = []
+        for poem_id, (url, total, beyts) in sums.items():
+            norm = np.linalg.norm(total)
+            centroid = (total / norm if norm else total).astype(np.float32)
+            rows.append((poem_id, centroid.tobytes(), url, beyts))
+        with self.transaction():
+            self._execute_many(f"DELETE FROM {self.poem_table} WHERE rowid = ?;", [(row[0],) for row in rows])
+            self._execute_many(
+                f"INSERT INTO {self.poem_table} (rowid, embedding, url, beyts) VALUES (?, ?, ?, ?);", rows
+            )
+
+    def _next_rowid(self):
+        row = self.conn.execute(f"SELECT max(rowid) FROM {self.table_name};").fetchone()
+        return (row[0] or 0) + 1
 
     def add_document(self, url, verses, vectors):
         """Adds a document chunk and its vector to the SQLite table."""
-        sql = f"INSERT INTO {self.table_name} (url, verse, embedding) VALUES (?, ?, ?);"
-        for verse, vector in zip(verses, vectors, strict=True):
-            self._execute_sql(sql, (url, verse, serialize_float32(vector)))
+        return self.add_documents([(url, verses, vectors)])
+
+    def add_documents(self, documents, batch_size=INDEX_BATCH_SIZE, row_ids=None):
+        """
+        Adds many documents in bulk, committing once per batch of rows.
+        documents is an iterable of (url, verses, vectors) or (url, verses, vectors, positions) tuples,
+        where positions are the (beyt, hemistich) of each verse; without them verses are numbered
+        as consecutive whole beyts. It is consumed lazily.
+        Every poem is expected to arrive whole in one call: the centroids of the poems seen are
+        replaced by the mean of the beyts added here.
+        If row_ids is a dict it is filled with url -> list of assigned rowids.
+        Returns the number of inserted rows.
+        """
+        import numpy as np
+
+        sql = (
+            f"INSERT INTO {self.table_name} (rowid, url, verse, embedding, poem_id, beyt, hemistich) "
+            f"VALUES (?, ?, ?, ?, ?, ?, ?);"
+        )
+        coarse_sqls = [
+            f"INSERT INTO {table} (rowid, embedding, hemistich) VALUES (?, {self._coarse_expr(storage, coarse_dim)}, ?);"
+            for table, storage, coarse_dim in self._coarse_tables()
+        ]
+        rescore = self._table_exists(self.rescore_table)
+        rescore_sql = f"INSERT INTO {self.rescore_table} (rowid, embedding) VALUES (?, ?);"
+        fts_sql = f"INSERT INTO {self.fts_table} (rowid, verse_norm, url, verse) VALUES (?, ?, ?, ?);"
+        rowids = count(self._next_rowid())
+        sums = {}
+        ivf_trained = self.ivf_trained()
+
+        def iter_rows():
+            for url, verses, vectors, *positions in documents:
+                poem_id = poem_number(url)
+                positions = positions[0] if positions else [(beyt, 0) for beyt in range(1, len(verses) + 1)]
+                for verse, vector, (beyt, hemistich) in zip(verses, vectors, positions, strict=True):
+                    rowid = next(rowids)
+                    if row_ids is not None:
+                        row_ids.setdefault(url, []).append(rowid)
+                    if hemistich == 0:
+                        self._accumulate(sums, poem_id, url, np.asarray(vector, dtype=np.float32))
+                    yield rowid, url, verse, serialize_float32(vector), poem_id, beyt, hemistich
+
+        rows = iter_rows()
+        inserted = 0
+        write_seconds = 0.0
+        with self.bulk_load():
+            for batch in batched(rows, batch_size):
+                start = time.perf_counter()
+                with self.transaction():
+                    self._execute_many(sql, batch)
+                    self._execute_many(
+                        fts_sql,
+                        [(row[0], normalize_persian(row[2]), row[1], row[2]) for row in batch if row[6] == 0],
+                    )
+                    for coarse_sql in coarse_sqls:
+                        self._execute_many(coarse_sql, [(row[0], row[3], row[6]) for row in batch])
+                    if rescore:
+                        self._execute_many(rescore_sql, [(row[0], row[3]) for row in batch])
+                    if ivf_trained:
+                        self._ivf_insert([(row[0], row[3], row[6]) for row in batch])
+                write_seconds += time.perf_counter() - start
+                inserted += len(batch)
+            self._write_centroids(sums)
+        rate = inserted / write_seconds if write_seconds else 0.0
+        logger.info(f"Bulk inserted {inserted} rows into {self.table_name} ({rate:.0f} rows/sec write).")
+        if inserted:
+            self._bump_version()
+        return inserted
 
-    def search(self, query_vector, top_k=3):
+    def delete_rows(self, row_ids):
+        """
+        Deletes rows from the vector, FTS and (if any) coarse, rescoring and IVF tables by rowid,
+        and the centroids of the poems they belong to.
+        """
+        params = [(rowid,) for rowid in row_ids]
+        poem_ids = set()
+        for chunk in batched(row_ids, 500):
+            sql = f"SELECT DISTINCT poem_id FROM {self.table_name} WHERE rowid IN ({', '.join('?' * len(chunk))});"
+            poem_ids.update(row[0] for row in self.conn.execute(sql, chunk))
+        side_tables = [table for table, _, _ in self._coarse_tables()]
+        if self._table_exists(self.rescore_table):
+            side_tables.append(self.rescore_table)
+        if self.ivf_trained():
+            side_tables.append(self.ivf_table)
+        with self.transaction():
+            self._execute_many(
+                f"DELETE FROM {self.poem_table} WHERE rowid = ?;", [(poem_id,) for poem_id in poem_ids]
+            )
+            for table in (self.table_name, self.fts_table, *side_tables):
+                self._execute_many(f"DELETE FROM {table} WHERE rowid = ?;", params)
+        if params:
+            self._bump_version()
+
+    def get_manifest(self):
+        """Returns {path: {"mtime", "content_hash", "poem_id", "row_ids"}} for every indexed file."""
+        cur = self.conn.execute(
+            f"SELECT path, mtime, content_hash, poem_id, row_ids FROM {self.manifest_table};"
+        )
+        return {
+            path: {
+                "mtime": mtime,
+                "content_hash": content_hash,
+                "poem_id": poem_id,
+                "row_ids": json.loads(row_ids),
+            }
+            for path, mtime, content_hash, poem_id, row_ids in cur.fetchall()
+        }
+
+    def upsert_manifest(self, entries):
+        """Inserts or replaces manifest entries, given as (path, mtime, content_hash, poem_id, row_ids) tuples."""
+        sql = f"INSERT OR REPLACE INTO {self.manifest_table} (path, mtime, content_hash, poem_id, row_ids) VALUES (?, ?, ?, ?, ?);"
+        self._execute_many(
+            sql,
+            [
+                (path, mtime, content_hash, poem_id, json.dumps(row_ids))
+                for path, mtime, content_hash, poem_id, row_ids in entries
+            ],
+        )
+
+    def delete_manifest(self, paths):
+        """Removes manifest entries for the given file paths."""
+        self._execute_many(f"DELETE FROM {self.manifest_table} WHERE path = ?;", [(path,) for path in paths])
+
+    def search(self, query_vector, top_k=3, poem_range=None):
         """
         Searches the index for the most similar document chunks using sqlite-vec.
+        poem_range = (first, last) restricts hits to those poem ids (inclusive); the filter is a vec0
+        metadata constraint of the exact scan, so filtered queries bypass the coarse and IVF passes.
         Returns a list of (url, verse, similarity_score)
         """
         if query_vector is None:
             logger.warning("Search query vector is None. Returning empty results.")
             return []
 
-        query_vector_json = json.dumps(query_vector)
-        # The 'distance' from vec_search is cosine distance if vectors are normalized,
-        # or L2 distance otherwise. OpenAI embeddings are typically normalized.
-        # similarity = 1 - distance (for cosine distance where 0 is identical)
-        sql = f"""
-        SELECT url, verse, distance
-        FROM {self.table_name}
-        WHERE embedding MATCH ?
-        ORDER BY distance
-        LIMIT ?;
-        """
+        # The table uses distance_metric=cosine, so distance is cosine distance in [0, 2]
+        # and 1 - distance is the cosine similarity.
+        query_blob = serialize_float32(query_vector)
         try:
-            cur = self._execute_sql(sql, (query_vector_json, top_k))
+            if poem_range is None and self.ann == "ivf" and self.ivf_trained():
+                rows = self._ivf_search(query_blob, top_k)
+            elif poem_range is None and self.coarse_table:
+                rows = self._coarse_search(query_blob, top_k)
+            else:
+                poem_filter = "" if poem_range is None else "AND poem_id BETWEEN ? AND ?"
+                sql = f"""
+                SELECT url, verse, distance
+                FROM {self.table_name}
+                WHERE embedding MATCH ? AND hemistich = 0 {poem_filter}
+                ORDER BY distance
+                LIMIT ?;
+                """
+                rows = self._execute_sql(sql, (query_blob, *(poem_range or ()), top_k)).fetchall()
             results = []
-            for row in cur.fetchall():
+            for row in rows:
                 url, verse, distance = row
-                # Assuming OpenAI embeddings are normalized, distance is cosine distance.
-                # For cosine similarity: similarity = (1 - distance) if distance is on [0, 2]
-                # Or, if OpenAI embeddings are pre-normalized and sqlite-vec uses dot product for MATCH
-                # with normalized vectors, then 'distance' might be 1 - similarity or similar.
-                # Let's assume distance is cosine distance, so similarity = 1 - distance.
-                # More accurately, for normalized vectors, cosine_similarity = (vector1 • vector2)
-                # Cosine Distance = 1 - cosine_similarity.
-                # If 'distance' is indeed cosine distance, then similarity = 1 - distance.
-                # If 'distance' from sqlite-vec for MATCH is L2 squared, this conversion needs adjustment.
-                # The sqlite-vec documentation implies 'distance' is L2 by default.
-                # For OpenAI embeddings, cosine similarity is preferred.
-                # To use cosine similarity with sqlite-vec, vectors should be normalized,
-                # and then `vec_dot_product` can be used, or rely on `MATCH` if it's L2
-                # and we accept that ranking (often similar to cosine for high-dim).
-                # For simplicity with `MATCH`, we'll treat distance as something to minimize.
-                # The score returned will be this 'distance'. User should know lower is better.
-                # OR, we stick to the original contract of returning a 'similarity_score'
-                # where higher is better. If distance is L2, this is tricky.
-                # Let's assume for now `MATCH` with normalized vectors provides a distance that
-                # can be inverted to a similarity-like score.
-                # If OpenAI embeddings are normalized (length 1), then L2 distance squared (d^2) relates to cosine similarity (cs) by d^2 = 2 - 2*cs.
-                # So, cs = 1 - (d^2 / 2).
-                # We will return `1 - distance` as a general proximity score, assuming distance is somewhat like cosine distance.
-                similarity_score = (
-                    1 - distance
-                )  # This might need refinement based on sqlite-vec's exact distance metric for MATCH
+                similarity_score = 1 - distance
                 results.append({"url": url, "verse": verse, "score": similarity_score})
             return results
         except Exception as e:
             logger.error(f"Error during search in {self.table_name}: {e}")
             return []
 
+    def ivf_trained(self):
+        return self._table_exists(self.ivf_centroid_table)
+
+    def train_ivf(self, n_lists=None, sample_size=None, iterations=10, seed=0):
+        """
+        Trains the IVF index: spherical k-means over a sample of the beyt and hemistich vectors, then
+        every row is assigned to its nearest centroid. Replaces any previous IVF tables.
+        n_lists defaults to about 4 * sqrt(rows) and sample_size to 256 vectors a list, which is plenty
+        for k-means to place the centroids. Later inserts are assigned to the trained centroids;
+        retrain after the corpus has grown or shifted a lot, as recall degrades with drift.
+        """
+        import numpy as np
+
+        total = self.conn.execute(f"SELECT count(*) FROM {self.table_name};").fetchone()[0]
+        if not total:
+            raise ValueError(f"Cannot train an IVF index on the empty table {self.table_name}")
+        n_lists = min(n_lists or max(1, int(4 * total**0.5)), total)
+        sample_size = sample_size or 256 * n_lists
+        start = time.perf_counter()
+
+        # reservoir sample of the vectors in one scan
+        rng = np.random.default_rng(seed)
+        sample = np.empty((min(sample_size, total), self.dim), dtype=np.float32)
+        for i, (blob,) in enumerate(self.conn.execute(f"SELECT embedding FROM {self.table_name};")):
+            j = i if i < len(sample) else rng.integers(0, i + 1)
+            if j < len(sample):
+                sample[j] = np.frombuffer(blob, dtype=np.float32)
+        sample /= np.maximum(np.linalg.norm(sample, axis=1, keepdims=True), 1e-12)
+
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self._nearest(centroids, sample)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=n_lists) == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]  # re-seed empty lists
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+        # every list gets its own vec0 chunks, so size them to the average list instead of the default 1024
+        chunk_size = min(1024, max(8, -(-total // n_lists // 8) * 8))
+        self._execute_sql(f"DROP TABLE IF EXISTS {self.ivf_table};")
+        self._execute_sql(f"DROP TABLE IF EXISTS {self.ivf_centroid_table};")
+        self._execute_sql(
+            f"CREATE VIRTUAL TABLE {self.ivf_centroid_table} USING vec0(embedding FLOAT[{self.dim}] distance_metric=cosine);"
+        )
+        self._execute_sql(
+            f"""
+            CREATE VIRTUAL TABLE {self.ivf_table} USING vec0(
+                list_id INTEGER PARTITION KEY,
+                embedding FLOAT[{self.dim}] distance_metric=cosine,
+                hemistich INTEGER,
+                chunk_size={chunk_size},
+            );
+            """
+        )
+        self._execute_many(
+            f"INSERT INTO {self.ivf_centroid_table} (rowid, embedding) VALUES (?, ?);",
+            [(list_id, centroid.tobytes()) for list_id, centroid in enumerate(centroids, start=1)],
+        )
+        self._ivf_centroids = None
+        # Assignments are staged in a temp table first: writing the IVF table while a cursor is still
+        # reading the vector table would pin the WAL, which then grows without bound.
+        staging = f"{self.ivf_table}_staging"
+        self.conn.execute(
+            f"CREATE TEMP TABLE {staging} (id INTEGER, list_id INTEGER, embedding BLOB, hemistich INTEGER);"
+        )
+        rows = self.conn.execute(f"SELECT rowid, embedding, hemistich FROM {self.table_name};")
+        while batch := rows.fetchmany(INDEX_BATCH_SIZE):
+            self._execute_many(f"INSERT INTO temp.{staging} VALUES (?, ?, ?, ?);", self._ivf_assign(batch))
+        rows.close()
+        with self.bulk_load():
+            # grouped by list, so every partition's chunks are filled in one go
+            self._execute_sql(
+                f"""
+                INSERT INTO {self.ivf_table} (rowid, list_id, embedding, hemistich)
+                SELECT id, list_id, embedding, hemistich FROM temp.{staging} ORDER BY list_id;
+                """
+            )
+        self._execute_sql(f"DROP TABLE temp.{staging};")
+        self._bump_version()
+        logger.info(
+            f"Trained IVF index of {self.table_name}: {total} rows in {n_lists} lists "
+            f"in {time.perf_counter() - start:.1f}s."
+        )
+
+    @staticmethod
+    def _nearest(centroids, vectors, chunk=8192):
+        """Index of the most cosine-similar (normalized) centroid of every vector."""
+        import numpy as np
+
+        return np.concatenate(
+            [np.argmax(vectors[i : i + chunk] @ centroids.T, axis=1) for i in range(0, len(vectors), chunk)]
+        )
+
+    def _ivf_assign(self, rows):
+        """Assigns (rowid, float32 blob, hemistich) rows to their nearest IVF list."""
+        import numpy as np
+
+        if self._ivf_centroids is None:
+            stored = self.conn.execute(f"SELECT rowid, embedding FROM {self.ivf_centroid_table};").fetchall()
+            self._ivf_centroids = (
+                np.array([list_id for list_id, _ in stored]),
+                np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in stored]),
+            )
+        list_ids, centroids = self._ivf_centroids
+        vectors = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob, _ in rows])
+        assignment = list_ids[self._nearest(centroids, vectors)]
+        return [
+            (rowid, int(list_id), blob, hemistich)
+            for (rowid, blob, hemistich), list_id in zip(rows, assignment, strict=True)
+        ]
+
+    def _ivf_insert(self, rows):
+        """Assigns (rowid, float32 blob, hemistich) rows to their nearest IVF list and stores them."""
+        self._execute_many(
+            f"INSERT INTO {self.ivf_table} (rowid, list_id, embedding, hemistich) VALUES (?, ?, ?, ?);",
+            self._ivf_assign(rows),
+        )
+
+    def _ivf_search(self, query_blob, top_k):
+        """KNN within the IVF lists of the `probes` centroids nearest to the query, merged by distance."""
+        sql = (
+            f"SELECT rowid FROM {self.ivf_centroid_table} WHERE embedding MATCH ? ORDER BY distance LIMIT ?;"
+        )
+        list_ids = [row[0] for row in self._execute_sql(sql, (query_blob, self.probes))]
+        # vec0 partition keys only take equality constraints, so each probed list is its own KNN
+        sql = f"""
+        SELECT rowid, distance
+        FROM {self.ivf_table}
+        WHERE embedding MATCH ? AND list_id = ? AND hemistich = 0
+        ORDER BY distance
+        LIMIT ?;
+        """
+        ranked = heapq.nsmallest(
+            top_k,
+            (row for list_id in list_ids for row in self.conn.execute(sql, (query_blob, list_id, top_k))),
+            key=lambda row: row[1],
+        )
+        metadata = self._verse_metadata([rowid for rowid, _ in ranked])
+        return [(*metadata[rowid], distance) for rowid, distance in ranked]
+
+    def _verse_metadata(self, rowids):
+        """
+        {rowid: (url, verse)} of beyt rows, read from the FTS table: a rowid lookup there is a b-tree
+        seek, while vec0 scans its chunks for rowid constraints.
+        """
+        sql = (
+            f"SELECT rowid, url, verse FROM {self.fts_table} WHERE rowid IN ({', '.join('?' * len(rowids))});"
+        )
+        return {rowid: (url, verse) for rowid, url, verse in self._execute_sql(sql, rowids)}
+
+    def _coarse_search(self, query_blob, top_k):
+        """KNN over the coarse vectors, then rescoring of top_k * rescore_factor candidates at full precision."""
+        sql = f"""
+        SELECT rowid
+        FROM {self.coarse_table}
+        WHERE embedding MATCH {self._coarse_expr()} AND hemistich = 0
+        ORDER BY distance
+        LIMIT ?;
+        """
+        candidates = [row[0] for row in self._execute_sql(sql, (query_blob, top_k * self.rescore_factor))]
+        sql = f"""
+        SELECT rowid, vec_distance_cosine(embedding, ?) AS distance
+        FROM {self.rescore_table}
+        WHERE rowid IN ({", ".join("?" * len(candidates))})
+        ORDER BY distance
+        LIMIT ?;
+        """
+        ranked = self._execute_sql(sql, (query_blob, *candidates, top_k)).fetchall()
+        metadata = self._verse_metadata([rowid for rowid, _ in ranked])
+        return [(*metadata[rowid], distance) for rowid, distance in ranked]
+
+    def search_poems(self, query_vector, top_poems=3, top_k=3):
+        """
+        Two-stage search: KNN over poem centroids picks the top_poems poems, then a verse KNN restricted
+        to those poems (beyts and hemistichs alike) ranks their verses. A hemistich hit counts for its beyt.
+        Returns one dict per poem, best first:
+        {"url", "poem_id", "score": centroid cosine similarity, "verses": [{"beyt", "verse", "score"}, ...]}
+        with at most top_k beyts per poem.
+        """
+        if query_vector is None:
+            logger.warning("Search query vector is None. Returning empty results.")
+            return []
+        query_blob = serialize_float32(query_vector)
+        try:
+            sql = f"""
+            SELECT rowid, url, distance
+            FROM {self.poem_table}
+            WHERE embedding MATCH ?
+            ORDER BY distance
+            LIMIT ?;
+            """
+            poems = self._execute_sql(sql, (query_blob, top_poems)).fetchall()
+            if not poems:
+                return []
+            poem_ids = [poem_id for poem_id, _, _ in poems]
+            # up to three rows (beyt + two hemistichs) per beyt, so over-fetch to fill top_k beyts per poem
+            sql = f"""
+            SELECT poem_id, beyt, hemistich, verse, distance
+            FROM {self.table_name}
+            WHERE embedding MATCH ? AND poem_id IN ({", ".join("?" * len(poem_ids))})
+            ORDER BY distance
+            LIMIT ?;
+            """
+            rows = self._execute_sql(sql, (query_blob, *poem_ids, top_k * len(poem_ids) * 3)).fetchall()
+        except Exception as e:
+            logger.error(f"Error during poem search in {self.poem_table}: {e}")
+            return []
+        results = {
+            poem_id: {"url": url, "poem_id": poem_id, "score": 1 - distance, "verses": []}
+            for poem_id, url, distance in poems
+        }
+        seen = set()
+        for poem_id, beyt, hemistich, verse, distance in rows:
+            verses = results[poem_id]["verses"]
+            if (poem_id, beyt) in seen or len(verses) >= top_k:
+                continue
+            seen.add((poem_id, beyt))
+            hit = {"beyt": beyt, "verse": verse, "score": 1 - distance}
+            if hemistich:
+                hit["hemistich"] = hemistich
+            verses.append(hit)
+        return list(results.values())
+
+    def lexical_search(self, query, top_k=3, phrase=False, poem_range=None):
+        """
+        BM25 search over the FTS5 table. Query and verses are compared after Persian normalization.
+        With phrase=True the normalized query must appear as an exact phrase; otherwise any of its
+        words may match. poem_range filters poem ids as in search().
+        Returns the same dicts as search(), with 'score' = bm25 squashed into (0, 1).
+        """
+        tokens = normalize_persian(query).split()
+        if not tokens:
+            return []
+        escaped = [token.replace('"', '""') for token in tokens]  # FTS5 string literals
+        if phrase:
+            match = '"' + " ".join(escaped) + '"'
+        else:
+            match = " OR ".join(f'"{token}"' for token in escaped)
+        poem_filter = "" if poem_range is None else "AND poem_number(url) BETWEEN ? AND ?"
+        sql = f"""
+        SELECT url, verse, bm25({self.fts_table}) AS rank
+        FROM {self.fts_table}
+        WHERE {self.fts_table} MATCH ? {poem_filter}
+        ORDER BY rank
+        LIMIT ?;
+        """
+        try:
+            rows = self._execute_sql(sql, (match, *(poem_range or ()), top_k)).fetchall()
+        except Exception as e:
+            logger.error(f"Error during lexical search in {self.fts_table}: {e}")
+            return []
+        # bm25() is negative, more negative is better
+        return [{"url": url, "verse": verse, "score": -rank / (1 - rank)} for url, verse, rank in rows]
+
+    def search_batch(self, query_vectors, top_k=3, poem_range=None):
+        """
+        Searches many query vectors over the same connection; returns one result list per query.
+        This is one KNN per query: vec0 scans for a single query vector, and reading the vectors out
+        of it for a shared scan in NumPy is far slower than its own scans (~0.6 ms a row). A batch
+        still saves the embedding round trips; NumpyIndex.search_batch scores a batch in one product.
+        """
+        return [
+            self.search(query_vector, top_k=top_k, poem_range=poem_range) for query_vector in query_vectors
+        ]
+
     def __del__(self):
         """Closes the database connection when the object is deleted."""
         if hasattr(self, "conn") and self.conn:
             self.conn.close()
             logger.info(f"Closed SQLite connection to {self.db_path}")
+
+
+class IndexPool:
+    """
+    Thread-safe pool of read-only Index connections, one per thread.
+    It exposes search() itself, so it can be passed anywhere an Index is used for searching.
+    """
+
+    def __init__(self, db_path=DB_PATH, table_name=TABLE_NAME):
+        self.db_path = db_path
+        self.table_name = table_name
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._indexes = []
+
+    def get(self):
+        """Returns the read-only Index of the calling thread, opening it on first use."""
+        index = getattr(self._local, "index", None)
+        if index is None:
+            index = Index(self.db_path, self.table_name, read_only=True)
+            self._local.index = index
+            with self._lock:
+                self._indexes.append(index)
+        return index
+
+    def warmup(self):
+        """
+        Runs schema setup and migrations once through a writable Index, so that no search pays for
+        them, and checks that queries use the embedding model the index was built with. Only the
+        calling thread's read-only connection is opened; every other thread opens its own on its
+        first search, which takes well under a millisecond.
+        """
+        Index(self.db_path, self.table_name).conn.close()
+        recorded = self.get().embedding_provider()
+        query_provider = get_embedding_provider().name
+        if recorded is not None and recorded[0] != query_provider:
+            logger.warning(
+                f"{self.db_path}/{self.table_name} was built with {recorded[0]} but queries use {query_provider}"
+            )
+        return self
+
+    def search(self, query_vector, top_k=3, poem_range=None):
+        return self.get().search(query_vector, top_k=top_k, poem_range=poem_range)
+
+    def search_batch(self, query_vectors, top_k=3, poem_range=None):
+        return self.get().search_batch(query_vectors, top_k=top_k, poem_range=poem_range)
+
+    def lexical_search(self, query, top_k=3, phrase=False, poem_range=None):
+        return self.get().lexical_search(query, top_k=top_k, phrase=phrase, poem_range=poem_range)
+
+    def search_poems(self, query_vector, top_poems=3, top_k=3):
+        return self.get().search_poems(query_vector, top_poems=top_poems, top_k=top_k)
+
+    def version(self):
+        return self.get().version()
+
+    def close(self):
+        with self._lock:
+            for index in self._indexes:
+                index.conn.close()
+            self._indexes.clear()
+        self._local = threading.local()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_index_pool(db_path=DB_PATH, table_name=TABLE_NAME):
+    """Returns the process-wide IndexPool for (db_path, table_name)."""
+    with _pools_lock:
+        key = (db_path, table_name)
+        if key not in _pools:
+            _pools[key] = IndexPool(db_path, table_name)
+        return _pools[key]
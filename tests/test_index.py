@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-test")
+os.environ.setdefault("EMBEDDING_MODEL", "hashing")
+
+from embeddings import HashingEmbedder
+from index import index_directory
+from sqlite_helper import Index
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "docs")
+
+
+class IncrementalIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.docs = os.path.join(self.tmp, "docs")
+        os.mkdir(self.docs)
+        for name in sorted(os.listdir(DOCS_DIR))[:3]:
+            shutil.copy(os.path.join(DOCS_DIR, name), self.docs)
+        self.embedder = HashingEmbedder(dim=64)
+        self.index = Index(db_path=os.path.join(self.tmp, "test.db"), dim=self.embedder.dim)
+
+    def tearDown(self):
+        self.index.conn.close()
+        shutil.rmtree(self.tmp)
+
+    def update(self):
+        return index_directory(self.docs, index_instance=self.index, incremental=True, embed_fn=self.embedder)
+
+    def stored_row_ids(self):
+        return {row[0] for row in self.index.conn.execute(f"SELECT rowid FROM {self.index.table_name};")}
+
+    def test_corrupted_file_does_not_keep_deleted_row_ids(self):
+        self.update()
+        manifest = self.index.get_manifest()
+        # the file with the highest row ids, whose ids are the next to be handed out once deleted
+        corrupted = max(manifest, key=lambda path: max(manifest[path]["row_ids"]))
+        with open(corrupted, "w", encoding="utf-8") as f:
+            f.write("not a poem\n")
+        added = shutil.copy(os.path.join(DOCS_DIR, sorted(os.listdir(DOCS_DIR))[3]), self.docs)
+
+        self.update()
+        self.update()
+
+        manifest = self.index.get_manifest()
+        self.assertNotIn(corrupted, manifest)
+        self.assertTrue(manifest[added]["row_ids"])
+        self.assertEqual(
+            self.stored_row_ids(), {row_id for entry in manifest.values() for row_id in entry["row_ids"]}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-test")
+os.environ.setdefault("EMBEDDING_MODEL", "hashing")
+
+from embeddings import get_embedding_provider
+from index import index_directory
+from numpy_index import get_numpy_index
+from sqlite_helper import Index
+from tools.semantic_search import semantic_search_tool
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "docs")
+
+
+class SyncedNumpyIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.docs = os.path.join(self.tmp, "docs")
+        os.mkdir(self.docs)
+        for name in sorted(os.listdir(DOCS_DIR))[:3]:
+            shutil.copy(os.path.join(DOCS_DIR, name), self.docs)
+        self.db_path = os.path.join(self.tmp, "test.db")
+        self.provider = get_embedding_provider()
+        self.reindex()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def reindex(self):
+        index = Index(db_path=self.db_path, dim=self.provider.dim)
+        index_directory(self.docs, index_instance=index, incremental=True, embed_fn=self.provider)
+        index.conn.close()
+
+    def added_poem(self):
+        """Copies a fourth poem into the docs; returns its url and first verse."""
+        added = shutil.copy(os.path.join(DOCS_DIR, sorted(os.listdir(DOCS_DIR))[3]), self.docs)
+        with open(added, encoding="utf-8") as f:
+            lines = [line.strip() for line in f if line.strip()]
+        return lines[0], lines[3]
+
+    def test_reindex_is_served_without_a_restart(self):
+        numpy_index = get_numpy_index(self.db_path, matrix_path=os.path.join(self.tmp, "test.npy"))
+        version = numpy_index.version()
+        url, verse = self.added_poem()
+        self.reindex()
+
+        self.assertNotEqual(numpy_index.version(), version)
+        hits = numpy_index.search(self.provider([verse])[0], top_k=1)
+        self.assertEqual([(hit["url"], hit["verse"]) for hit in hits], [(url, verse)])
+
+    def test_cached_tool_results_follow_the_served_matrix(self):
+        numpy_index = get_numpy_index(self.db_path, matrix_path=os.path.join(self.tmp, "test.npy"))
+        url, verse = self.added_poem()
+        query = " ".join(reversed(verse.split()))  # not a verbatim phrase, so the vector search answers it
+        before = semantic_search_tool([query], top_k=3, index_instance=numpy_index)
+        self.assertNotIn(url, [hit["url"] for hit in before])
+        self.reindex()
+
+        after = semantic_search_tool([query], top_k=3, index_instance=numpy_index)
+        self.assertIn(url, [hit["url"] for hit in after])
+
+    def test_missing_database(self):
+        with self.assertRaises(FileNotFoundError):
+            get_numpy_index(os.path.join(self.tmp, "missing.db"), matrix_path=os.path.join(self.tmp, "m.npy"))
+
+
+if __name__ == "__main__":
+    unittest.main()
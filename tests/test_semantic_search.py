@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-test")
+os.environ.setdefault("EMBEDDING_MODEL", "hashing")
+
+from embeddings import get_embedding_provider
+from index import index_directory
+from sqlite_helper import Index
+from tools.semantic_search import encode_search_results, semantic_search_tool
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "docs")
+
+
+class SemanticSearchToolTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        docs = os.path.join(cls.tmp, "docs")
+        os.mkdir(docs)
+        for name in sorted(os.listdir(DOCS_DIR))[:20]:
+            shutil.copy(os.path.join(DOCS_DIR, name), docs)
+        provider = get_embedding_provider()
+        cls.index = Index(db_path=os.path.join(cls.tmp, "test.db"), dim=provider.dim)
+        index_directory(docs, index_instance=cls.index, embed_fn=provider)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.index.conn.close()
+        shutil.rmtree(cls.tmp)
+
+    def test_results_are_truncated_to_top_k_per_query(self):
+        for queries in (["شمع"], ["ساقی", "می"]):
+            results = semantic_search_tool(queries, top_k=2, index_instance=self.index)
+            self.assertTrue(results)
+            self.assertLessEqual(len(results), 2 * len(queries))
+
+    def test_lexical_and_vector_scores_are_kept_apart(self):
+        results = semantic_search_tool(["شمع"], top_k=5, index_instance=self.index)
+        lexical = [hit for hit in results if "lexical_score" in hit]
+        self.assertTrue(lexical)
+        for hit in results:
+            self.assertTrue("score" in hit or "lexical_score" in hit)
+            if "score" in hit:
+                self.assertLessEqual(hit["score"], 1.0)
+        self.assertEqual(
+            sum(len(hits) for hits in json.loads(encode_search_results(results))["poems"].values()),
+            len(results),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
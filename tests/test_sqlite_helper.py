@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault("OPENAI_API_KEY", "offline-test")
+os.environ.setdefault("EMBEDDING_MODEL", "hashing")
+
+from embeddings import HashingEmbedder
+from index import index_directory
+from numpy_index import NumpyIndex
+from sqlite_helper import Index, IndexPool
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "docs")
+
+
+class ReopenIndexTest(unittest.TestCase):
+    """A 48-dimensional index, reopened the way other callers and storage modes open it."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.docs = os.path.join(self.tmp, "docs")
+        os.mkdir(self.docs)
+        for name in sorted(os.listdir(DOCS_DIR))[:3]:
+            shutil.copy(os.path.join(DOCS_DIR, name), self.docs)
+        self.db_path = os.path.join(self.tmp, "test.db")
+        self.embedder = HashingEmbedder(dim=48)
+        index = Index(db_path=self.db_path, dim=self.embedder.dim)
+        index_directory(self.docs, index_instance=index, embed_fn=self.embedder)
+        index.conn.close()
+        self.query = self.embedder(["شمع"])[0]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_dimension_is_read_from_the_database(self):
+        index = Index(db_path=self.db_path)
+        self.assertEqual(index.dim, 48)
+        self.assertEqual(len(index.search(self.query, top_k=3)), 3)
+        index.conn.close()
+
+    def test_quantized_storage(self):
+        index = Index(db_path=self.db_path, storage="int8")
+        self.assertEqual(index.coarse_dim, 48)
+        self.assertEqual(len(index.search(self.query, top_k=3)), 3)
+        index.conn.close()
+
+    def test_pool_and_numpy_export(self):
+        pool = IndexPool(self.db_path).warmup()
+        self.assertEqual(pool.get().dim, 48)
+        matrix = NumpyIndex.build(pool.get(), os.path.join(self.tmp, "test.npy"))
+        self.assertEqual(matrix.matrix.shape[1], 48)
+        self.assertEqual(len(matrix.search(self.query, top_k=3)), 3)
+        pool.close()
+
+    def test_quantized_tables_follow_float32_writes(self):
+        Index(db_path=self.db_path, storage="int8").conn.close()  # creates the int8 and rescoring tables
+        os.remove(os.path.join(self.docs, sorted(os.listdir(self.docs))[0]))
+        added = shutil.copy(os.path.join(DOCS_DIR, sorted(os.listdir(DOCS_DIR))[3]), self.docs)
+        index = Index(db_path=self.db_path)
+        index_directory(self.docs, index_instance=index, incremental=True, embed_fn=self.embedder)
+        index.conn.close()
+
+        index = Index(db_path=self.db_path, storage="int8")
+        rows = index.conn.execute(f"SELECT count(*) FROM {index.table_name};").fetchone()[0]
+        for table in (index.coarse_table, index.rescore_table):
+            self.assertEqual(index.conn.execute(f"SELECT count(*) FROM {table};").fetchone()[0], rows)
+        url, verse = index.conn.execute(
+            f"SELECT url, verse FROM {index.fts_table} WHERE rowid = (SELECT max(rowid) FROM {index.fts_table});"
+        ).fetchone()
+        hits = index.search(self.embedder([verse])[0], top_k=1)
+        self.assertEqual([(hit["url"], hit["verse"]) for hit in hits], [(url, verse)])
+        with open(added, encoding="utf-8") as f:
+            self.assertIn(url, f.read())
+        index.conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+class StageTimer:
+    """
+    Collects wall-clock durations of named stages (embed, knn, serialize, tool dispatch, ...) from any
+    thread. The most recent max_samples durations per stage are kept for percentiles.
+    """
+
+    def __init__(self, max_samples=10_000):
+        self.max_samples = max_samples
+        self._samples = {}
+        self._counts = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage):
+        """Times the body of a with-block as one sample of stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            if stage not in self._samples:
+                self._samples[stage] = deque(maxlen=self.max_samples)
+                self._counts[stage] = 0
+                self._totals[stage] = 0.0
+            self._samples[stage].append(seconds)
+            self._counts[stage] += 1
+            self._totals[stage] += seconds
+        logger.debug(f"{stage}: {seconds * 1000:.2f}ms")
+
+    def stats(self):
+        """Per-stage count, mean and p50/p95/p99 in milliseconds, as a JSON-serializable dict."""
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+            counts = dict(self._counts)
+            totals = dict(self._totals)
+        return {
+            stage: {
+                "count": counts[stage],
+                "mean_ms": totals[stage] / counts[stage] * 1000,
+                "p50_ms": percentile(values, 0.5) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+            }
+            for stage, values in samples.items()
+        }
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._totals.clear()
+
+
+_timer = StageTimer()
+
+
+def get_stage_timer():
+    """Returns the process-wide StageTimer."""
+    return _timer
+
+
+def span(stage):
+    """Times a with-block as a sample of stage on the process-wide StageTimer."""
+    return _timer.span(stage)
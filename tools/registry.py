@@ -1,5 +1,24 @@
+import bisect
+import importlib
 import inspect
-from typing import Any, Dict
+import logging
+import threading
+import time
+import types
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Tuple
+
+from timing import span
+
+logger = logging.getLogger(__name__)
+
+# seconds a tool call may take in run_many before its result is reported as a timeout
+DEFAULT_TOOL_TIMEOUT = 30.0
+
+# upper bounds (ms) of the per-tool latency histogram buckets; the last bucket is +inf
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
 
 _JSON_SCHEMA_TYPE_MAP = {
     "str": "string",
@@ -9,61 +28,366 @@ _JSON_SCHEMA_TYPE_MAP = {
 }
 
 
-class ToolRegistry:
+def _coerce_str(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError(f"expected a string, got {value!r}")
+
+
+def _coerce_int(value):
+    if isinstance(value, bool):
+        raise ValueError(f"expected an integer, got {value!r}")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value)
+    raise ValueError(f"expected an integer, got {value!r}")
+
+
+def _coerce_float(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    raise ValueError(f"expected a number, got {value!r}")
+
+
+def _coerce_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    raise ValueError(f"expected a boolean, got {value!r}")
+
+
+_COERCERS = {
+    "str": _coerce_str,
+    "int": _coerce_int,
+    "float": _coerce_float,
+    "bool": _coerce_bool,
+}
+
+
+def _compile_type(annotation):
+    """Returns (json schema, coercer) for a supported annotation, or None."""
+    if typing.get_origin(annotation) is list:
+        (item_annotation,) = typing.get_args(annotation) or (str,)
+        compiled = _compile_type(item_annotation)
+        if compiled is None:
+            return None
+        item_schema, item_coerce = compiled
+
+        def coerce_list(value):
+            if not isinstance(value, list):
+                value = [value]  # a lone item where a list was expected
+            return [item_coerce(item) for item in value]
+
+        return {"type": "array", "items": item_schema}, coerce_list
+    name = getattr(annotation, "__name__", None)
+    if name not in _JSON_SCHEMA_TYPE_MAP:
+        return None
+    return {"type": _JSON_SCHEMA_TYPE_MAP[name]}, _COERCERS[name]
+
+
+def _optional_inner(annotation):
+    """Returns X for Optional[X] / X | None annotations, else None."""
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        if len(args) == 1 and len(typing.get_args(annotation)) == 2:
+            return args[0]
+    return None
+
+
+class _CompiledTool:
+    """A tool's cached JSON schema plus an argument validator/coercer built from its signature."""
+
+    def __init__(self, tool: Any):
+        self.name = tool.__name__
+        self.params = {}  # name -> (coerce, default, nullable)
+        properties = {}
+        for name, param in inspect.signature(tool).parameters.items():
+            annotation = param.annotation
+            if annotation is inspect.Parameter.empty:
+                raise ValueError(f"Parameter {name} of tool {self.name} has no type annotation")
+            has_default = param.default is not inspect.Parameter.empty
+            inner = _optional_inner(annotation)
+            nullable = inner is not None or has_default
+            compiled = _compile_type(inner if inner is not None else annotation)
+            if compiled is None:
+                if has_default:
+                    continue  # not exposed to the model, e.g. injected dependencies
+                raise ValueError(f"Unsupported type: {getattr(annotation, '__name__', annotation)}")
+            schema, coerce = compiled
+            if nullable:
+                # strict mode requires every property, so optional ones accept null instead
+                schema = {**schema, "type": [schema["type"], "null"]}
+            properties[name] = schema
+            self.params[name] = (coerce, param.default if has_default else None, nullable)
+
+        self.schema = {
+            "type": "function",
+            "name": self.name,
+            "description": tool.__doc__.strip(),
+            "parameters": {
+                "type": "object",
+                "properties": properties,
+                "required": list(properties),
+                "additionalProperties": False,
+            },
+            "strict": True,
+        }
+
+    def coerce(self, arg: Dict[str, Any]) -> Dict[str, Any]:
+        """Validates and coerces model-supplied arguments; null or missing optionals get their defaults."""
+        unknown = arg.keys() - self.params.keys()
+        if unknown:
+            raise ValueError(f"Unknown arguments for tool {self.name}: {sorted(unknown)}")
+        kwargs = {}
+        for name, (coerce, default, nullable) in self.params.items():
+            value = arg.get(name)
+            if value is None:
+                if not nullable:
+                    raise ValueError(f"Missing required argument {name} for tool {self.name}")
+                kwargs[name] = default
+                continue
+            try:
+                kwargs[name] = coerce(value)
+            except ValueError as e:
+                raise ValueError(f"Invalid argument {name} for tool {self.name}: {e}") from e
+        return kwargs
+
+
+class _ToolMetrics:
     def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def observe(self, seconds: float, failed: bool):
+        self.calls += 1
+        self.errors += failed
+        self.total_seconds += seconds
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+
+    def export(self) -> Dict[str, Any]:
+        bounds = [str(b) for b in LATENCY_BUCKETS_MS] + ["+inf"]
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "mean_ms": self.total_seconds / self.calls * 1000 if self.calls else 0.0,
+            "latency_ms_buckets": dict(zip(bounds, self.buckets, strict=True)),
+        }
+
+
+class Lazy:
+    """
+    A tool dependency built by factory on first use, e.g. Lazy(lambda: get_search_index().warmup()),
+    so that registering a tool opens no index or client. The factory runs once; if it raises, the
+    next use tries again.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self.factory = factory
+        self._value = None
+        self._built = False
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._value = self.factory()
+                    self._built = True
+        return self._value
+
+
+class ToolRegistry:
+    def __init__(self, max_workers: int = 8):
         self._tools: Dict[str, Any] = {}
+        self._pending: Dict[str, str] = {}  # name -> "module:function" of tools not imported yet
+        self._load_lock = threading.Lock()
+        self._compiled: Dict[str, _CompiledTool] = {}
+        self._dependencies: Dict[str, Dict[str, Any]] = {}
+        self._timeouts: Dict[str, float] = {}
+        self._encoders: Dict[str, Callable[[Any], str]] = {}
+        self._metrics: Dict[str, _ToolMetrics] = {}
+        self._metrics_lock = threading.Lock()
+        self._max_workers = max_workers
+        self._executor = None
+
+    def register(
+        self,
+        tool: Any,
+        timeout: float = DEFAULT_TOOL_TIMEOUT,
+        encoder: Callable[[Any], str] = None,
+        **dependencies: Any,
+    ):
+        """
+        Register a tool instance under its name, compiling its schema and argument validator once.
+        tool may also be a "module:function" import path, e.g. "tools.semantic_search:semantic_search_tool";
+        its module is then imported and compiled on first use (or by warmup) rather than here.
+        dependencies are injected as keyword arguments on every run (e.g. a shared index_instance);
+        they are never exposed to the model, and Lazy ones are built on the first run.
+        timeout applies when the tool runs through run_many. encoder turns the tool's output into the
+        text sent back to the model; it defaults to the tool's `output_encoder` attribute, or str.
+        """
+        if isinstance(tool, str):
+            name = tool.rpartition(":")[2]
+            self._pending[name] = tool
+        else:
+            name = tool.__name__
+            self._compile(name, tool)
+        self._dependencies[name] = dependencies
+        self._timeouts[name] = timeout
+        if encoder is not None:
+            self._encoders[name] = encoder
+        self._metrics[name] = _ToolMetrics()
+
+    def _compile(self, name: str, tool: Any):
+        self._compiled[name] = _CompiledTool(tool)
+        self._tools[name] = tool
+        self._encoders.setdefault(name, getattr(tool, "output_encoder", str))
 
-    def register(self, tool: Any):
-        """Register a tool instance under its name"""
-        self._tools[tool.__name__] = tool
+    def _load(self):
+        """Imports and compiles the tools registered by import path."""
+        if not self._pending:
+            return
+        with self._load_lock:
+            for name, path in list(self._pending.items()):
+                module, _, attr = path.partition(":")
+                self._compile(name, getattr(importlib.import_module(module), attr))
+                del self._pending[name]
+
+    def warmup(self, background: bool = False) -> "ToolRegistry":
+        """
+        Imports pending tools and builds their Lazy dependencies, so the first call does not pay for it.
+        With background=True this runs on a daemon thread; a failure is logged and retried on first use.
+        """
+        if background:
+            threading.Thread(target=self._warmup_logged, name="tool-warmup", daemon=True).start()
+            return self
+        self._load()
+        for dependencies in self._dependencies.values():
+            for dependency in dependencies.values():
+                if isinstance(dependency, Lazy):
+                    dependency.get()
+        return self
+
+    def _warmup_logged(self):
+        start = time.perf_counter()
+        try:
+            self.warmup()
+        except Exception as e:
+            logger.error(f"Tool warmup failed: {e}")
+            return
+        logger.info(f"Tools ready in {time.perf_counter() - start:.2f}s")
+
+    def encoder(self, name: str) -> Callable[[Any], str]:
+        """Return the output encoder of a tool (str for unknown tools and error outputs)."""
+        self._load()
+        return self._encoders.get(name, str)
+
+    def encode(self, name: str, output: Any) -> str:
+        """Serialize a tool output for the model with the tool's encoder."""
+        if isinstance(output, dict) and "error" in output:
+            return str(output)
+        with span("serialize"):
+            return self.encoder(name)(output)
 
     def run(self, name: str, arg: Any) -> Any:
-        """Run a tool by name with the given argument"""
+        """Run a tool by name with the given argument, after validating and coercing it"""
+        self._load()
         if name not in self._tools:
             raise ValueError(f"Tool {name} not found")
-        return self._tools[name](**arg)
+        start = time.perf_counter()
+        failed = True
+        try:
+            kwargs = self._compiled[name].coerce(arg)
+            dependencies = {
+                key: value.get() if isinstance(value, Lazy) else value
+                for key, value in self._dependencies[name].items()
+            }
+            output = self._tools[name](**kwargs, **dependencies)
+            failed = False
+            return output
+        finally:
+            with self._metrics_lock:
+                self._metrics[name].observe(time.perf_counter() - start, failed)
+
+    def submit(self, name: str, arg: Any) -> Future:
+        """Start a tool call on the registry's thread pool and return its future."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="tool")
+        return self._executor.submit(self.run, name, arg)
+
+    def result(self, name: str, future: Future, started: float) -> Any:
+        """
+        Wait for a future returned by submit, at most until the tool's timeout counted from `started`
+        (a time.monotonic() value). A call that raises or times out yields {"error": ...} instead of
+        an output, so one failing tool does not lose the results of the others.
+        """
+        deadline = started + self._timeouts.get(name, DEFAULT_TOOL_TIMEOUT)
+        try:
+            with span("tool_dispatch"):
+                return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            logger.error(f"Tool {name} timed out")
+            return {"error": f"tool {name} timed out"}
+        except Exception as e:
+            logger.error(f"Tool {name} failed: {e}")
+            return {"error": f"tool {name} failed: {e}"}
+
+    async def run_async(self, name: str, arg: Any, executor: ThreadPoolExecutor = None) -> Any:
+        """
+        Awaitable tool call for asyncio callers: runs the tool on executor (default: the registry's
+        pool) without blocking the event loop. Like result, a call that raises or exceeds the tool's
+        timeout yields {"error": ...}; the worker thread itself cannot be interrupted.
+        """
+        import asyncio  # only the server needs it; keeps the REPL's startup lean
+
+        if executor is None:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="tool")
+            executor = self._executor
+        loop = asyncio.get_running_loop()
+        try:
+            with span("tool_dispatch"):
+                return await asyncio.wait_for(
+                    loop.run_in_executor(executor, self.run, name, arg),
+                    timeout=self._timeouts.get(name, DEFAULT_TOOL_TIMEOUT),
+                )
+        except TimeoutError:
+            logger.error(f"Tool {name} timed out")
+            return {"error": f"tool {name} timed out"}
+        except Exception as e:
+            logger.error(f"Tool {name} failed: {e}")
+            return {"error": f"tool {name} failed: {e}"}
+
+    def run_many(self, calls: List[Tuple[str, Any]]) -> List[Any]:
+        """Run several (name, arg) tool calls concurrently and return their outputs in order."""
+        started = time.monotonic()
+        futures = [self.submit(name, arg) for name, arg in calls]
+        return [self.result(name, future, started) for (name, _), future in zip(calls, futures, strict=True)]
 
     @property
     def tools(self) -> Dict[str, Any]:
+        self._load()
         return self._tools
 
     def get_tools(self):
-        res = []
-        for func_name, tool in self._tools.items():
-            sig = inspect.signature(tool)
-            params = {}
-            required = []
-            for name, param in sig.parameters.items():
-                json_type_str = ""
-
-                annotation = param.annotation
-                assert annotation is not inspect.Parameter.empty and hasattr(annotation, "__name__"), (
-                    f"Unsupported type: {annotation.__name__}"
-                )
-                if annotation.__name__ not in _JSON_SCHEMA_TYPE_MAP:
-                    if param.default is not inspect.Parameter.empty:
-                        continue
-                    else:
-                        raise ValueError(f"Unsupported type: {annotation.__name__}")
-                json_type_str = _JSON_SCHEMA_TYPE_MAP[annotation.__name__]
-
-                params[name] = {
-                    "type": json_type_str,
-                }
-                required.append(name)
-
-            res.append(
-                {
-                    "type": "function",
-                    "name": func_name,
-                    "description": tool.__doc__.strip(),
-                    "parameters": {
-                        "type": "object",
-                        "properties": params,
-                        "required": required,
-                        "additionalProperties": False,
-                    },
-                    "strict": True,
-                }
-            )
-        return res
+        """Return the tool schemas compiled at register (or first load) time."""
+        self._load()
+        return [compiled.schema for compiled in self._compiled.values()]
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Per-tool call counts, error counts and latency histograms, as a JSON-serializable dict."""
+        with self._metrics_lock:
+            return {name: metrics.export() for name, metrics in self._metrics.items()}
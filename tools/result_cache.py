@@ -0,0 +1,94 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from settings import RESULT_CACHE_PATH, RESULT_CACHE_SIZE, RESULT_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    LRU + TTL cache of search results, optionally persisted to a SQLite file.
+    Keys are tuples of strings/ints, e.g. (normalized query, top_k, model, index version), so
+    results of an older index are never served once the version changes.
+    """
+
+    def __init__(self, max_items=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, db_path=RESULT_CACHE_PATH):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+        if db_path:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS result_cache (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL);"
+            )
+            self.conn.execute("DELETE FROM result_cache WHERE expires_at < ?;", (time.time(),))
+            self.conn.commit()
+
+    def get(self, key):
+        """Returns the cached value for key, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None and self.conn is not None:
+                row = self.conn.execute(
+                    "SELECT expires_at, value FROM result_cache WHERE key = ?;", (json.dumps(key),)
+                ).fetchone()
+                if row is not None:
+                    item = (row[0], json.loads(row[1]))
+                    self._items[key] = item
+            if item is None or item[0] < now:
+                self._items.pop(key, None)
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self._evict()  # a disk hit adds an item
+            self.hits += 1
+            return item[1]
+
+    def _evict(self):
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def put(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._items[key] = (expires_at, value)
+            self._items.move_to_end(key)
+            self._evict()
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO result_cache (key, expires_at, value) VALUES (?, ?, ?);",
+                    (json.dumps(key), expires_at, json.dumps(value, ensure_ascii=False)),
+                )
+                self.conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "items": len(self._items),
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Returns the process-wide search result cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
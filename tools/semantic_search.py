@@ -1,57 +1,272 @@
+import json
 import logging
 
-import openai
-
-from settings import EMBEDDING_MODEL, OPENAI_API_KEY
-from sqlite_helper import Index
+from embeddings import embed_cached, get_embedding_provider, normalize_text
+from persian import normalize_persian
+from settings import (
+    LEXICAL_FAST_PATH_MIN_WORDS,
+    POEM_BASE_URL,
+    RRF_K,
+    SEARCH_BACKEND,
+    SEARCH_MODE,
+)
+from shards import get_sharded_index
+from sqlite_helper import Index, poem_ref
+from timing import span
+from tools.result_cache import get_result_cache
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 
-_openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+def get_embedding(text, provider=None):
+    """Returns the embedding for the given text, calling the embedding provider only on an embedding cache miss."""
+    embeddings = embed_cached([text], provider)
+    return embeddings[0] if embeddings else None
+
+
+def get_search_index():
+    """Returns the shared index over all collections, on the backend selected by settings.SEARCH_BACKEND."""
+    return get_sharded_index(SEARCH_BACKEND)
+
+
+def get_embeddings(texts, provider=None):
+    """Returns embeddings for all texts, fetching every cache miss in a single provider call."""
+    return embed_cached(texts, provider)
 
 
-def get_embedding(text, model=EMBEDDING_MODEL):
-    """Generates an embedding for the given text using the specified OpenAI model."""
-    try:
-        text = text.replace("\n", " ")
-        response = _openai_client.embeddings.create(input=[text], model=model)
-        return response.data[0].embedding
-    except Exception as e:
-        logger.error(f"Error generating embedding: {e}")
-        return None
+def reciprocal_rank_fusion(result_lists, k=RRF_K):
+    """
+    Merges ranked result lists, deduplicating hits by (url, verse).
+    Each hit gets 'rrf' = sum of 1 / (k + rank) over the lists it appears in, and keeps its best
+    'score' (vector lists) and 'lexical_score' (lexical lists) when it has them.
+    """
+    fused = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            key = (result["url"], result["verse"])
+            hit = fused.setdefault(key, {**result, "rrf": 0.0})
+            hit["rrf"] += 1.0 / (k + rank)
+            for name in ("score", "lexical_score"):
+                if name in result:
+                    hit[name] = max(hit.get(name, result[name]), result[name])
+    return sorted(fused.values(), key=lambda hit: hit["rrf"], reverse=True)
 
 
-def semantic_search_tool(query: str, top_k: int = 3, index_instance: Index = None) -> list[dict]:
+def encode_search_results(results, base_url=POEM_BASE_URL, digits=2):
+    """
+    Compact, token-efficient serialization of search results for the model: hits are grouped by
+    poem id (the URL minus base_url), similarities are rounded (null for hits found only by exact
+    words) and repeated keys are dropped, e.g.
+    {"base":"https://ganjoor.net/hafez/ghazal/","poems":{"sh12":[[0.53,"verse ..."]]}}
     """
-    find most top_k similar verses from hafez to the query
+    poems = {}
+    for result in results:
+        poem_id = poem_ref(result["url"], base_url)
+        score = result.get("score")
+        poems.setdefault(poem_id, []).append(
+            [None if score is None else round(score, digits), result["verse"]]
+        )
+    return json.dumps({"base": base_url, "poems": poems}, ensure_ascii=False, separators=(",", ":"))
+
+
+def _filters(poet, form, poem_from, poem_to):
+    """Keyword filters for the search backend; poet/form are only passed when set (sharded backends)."""
+    filters = {"poem_range": None}
+    if poem_from is not None or poem_to is not None:
+        filters["poem_range"] = (poem_from or 0, poem_to if poem_to is not None else 2**31)
+    if poet is not None:
+        filters["poet"] = poet
+    if form is not None:
+        filters["form"] = form
+    return filters
+
+
+def _lexical_hits(hits):
+    """Lexical hits with their BM25-based score under 'lexical_score', apart from cosine similarities."""
+    return [
+        {**{key: value for key, value in hit.items() if key != "score"}, "lexical_score": hit["score"]}
+        for hit in hits
+    ]
+
+
+def semantic_search_tool(
+    queries: list[str],
+    top_k: int = 3,
+    poet: str = None,
+    form: str = None,
+    poem_from: int = None,
+    poem_to: int = None,
+    index_instance: Index = None,
+) -> list[dict]:
+    """
+    find most top_k similar verses from hafez to each of the queries, by meaning and by exact words.
+    pass several related queries in one call instead of calling the tool several times.
 
     Args:
-        query: The search query string. (should be in persian alphabet)
-        top_k: The number of top verses
+        queries: The search query strings. (should be in persian alphabet)
+        top_k: The number of top verses per query
+        poet: Only search this poet's collections, e.g. "hafez" (null for all)
+        form: Only search this form, e.g. "ghazal" (null for all)
+        poem_from: Only search poems numbered from this one on, e.g. 1 for sh1 (null for no lower bound)
+        poem_to: Only search poems numbered up to this one (null for no upper bound)
 
     Returns:
-        A list of dictionaries, where each dictionary contains:
+        At most top_k * len(queries) dictionaries, deduplicated across queries and ordered by
+        reciprocal-rank fusion, where each dictionary contains:
         - 'url': url to the matched poem.
         - 'verse': The matched verse.
-        - 'score': The similarity score (higher is better, derived from distance).
+        - 'rrf': The fused reciprocal-rank score (higher is better).
+        - 'score': The best cosine similarity over the queries, if a semantic search found the verse.
+        - 'lexical_score': The best BM25 score squashed into (0, 1), if an exact-word search found it.
+        The model receives them compacted by encode_search_results:
+        {"base": poem url prefix, "poems": {poem_id: [[score or null, verse], ...]}}
     """
     if index_instance is None:
-        index = Index()
+        index = get_search_index()
     else:
         index = index_instance
 
-    logger.info(f"Executing semantic search for query: '{query}' with top_k={top_k}")
-    if not query:
+    if isinstance(queries, str):
+        queries = [queries]
+    queries = [query for query in queries if query and query.strip()]
+    filters = _filters(poet, form, poem_from, poem_to)
+    logger.info(f"Executing semantic search for queries: {queries} with top_k={top_k} and filters {filters}")
+    if not queries:
         logger.warning("Semantic search query is empty.")
         return []
 
-    query_embedding = get_embedding(query)
-    if query_embedding is None:
-        logger.error("Failed to generate embedding for the query.")
+    lexical_lists = []
+    vector_queries = queries
+    if SEARCH_MODE == "hybrid":
+        vector_queries = []
+        with span("lexical"):
+            for query in queries:
+                # Fast path: a long enough query found verbatim is answered without an embedding call
+                if len(normalize_persian(query).split()) >= LEXICAL_FAST_PATH_MIN_WORDS:
+                    phrase_hits = index.lexical_search(query, top_k=top_k, phrase=True, **filters)
+                    if phrase_hits:
+                        lexical_lists.append(_lexical_hits(phrase_hits))
+                        continue
+                lexical_lists.append(_lexical_hits(index.lexical_search(query, top_k=top_k, **filters)))
+                vector_queries.append(query)
+
+    # Warm queries skip both the embedding call and the KNN scan. The key holds the version of the
+    # vectors the backend searches (a SyncedNumpyIndex re-exports its matrix before reporting a new
+    # version), so cached results are dropped exactly when the searched vectors change.
+    cache = get_result_cache()
+    version = index.version()
+    filter_key = tuple(sorted(filters.items()))
+    keys = [
+        (normalize_text(query), top_k, filter_key, get_embedding_provider().name, version)
+        for query in vector_queries
+    ]
+    per_query = [cache.get(key) for key in keys]
+    missing = [i for i, results in enumerate(per_query) if results is None]
+    if missing:
+        with span("embed"):
+            query_embeddings = get_embeddings([vector_queries[i] for i in missing])
+        if query_embeddings is None:
+            logger.error("Failed to generate embeddings for the queries.")
+            return []
+        with span("knn"):
+            batch_results = index.search_batch(query_embeddings, top_k=top_k, **filters)
+        for i, results in zip(missing, batch_results, strict=True):
+            per_query[i] = results
+            cache.put(keys[i], results)
+
+    with span("fuse"):
+        results = reciprocal_rank_fusion(per_query + lexical_lists)[: top_k * len(queries)]
+    logger.info(f"Found {len(results)} results for queries {queries}.")
+    return results
+
+
+semantic_search_tool.output_encoder = encode_search_results
+
+
+def encode_poem_results(results, base_url=POEM_BASE_URL, digits=2):
+    """
+    Compact serialization of poem_search_tool results, e.g.
+    {"base":"https://ganjoor.net/hafez/ghazal/","poems":{"sh12":{"score":0.61,"beyts":[[3,0.55,"verse ..."]]}}}
+    """
+    poems = {}
+    for poem in results:
+        poems[poem_ref(poem["url"], base_url)] = {
+            "score": round(poem["score"], digits),
+            "beyts": [[hit["beyt"], round(hit["score"], digits), hit["verse"]] for hit in poem["verses"]],
+        }
+    return json.dumps({"base": base_url, "poems": poems}, ensure_ascii=False, separators=(",", ":"))
+
+
+def poem_search_tool(
+    queries: list[str],
+    top_poems: int = 3,
+    verses_per_poem: int = 2,
+    poet: str = None,
+    form: str = None,
+    index_instance: Index = None,
+) -> list[dict]:
+    """
+    find the top_poems ghazals of hafez whose overall theme is closest to the queries, with their best
+    matching beyts. use it for questions about whole poems ("which ghazal is about ...").
+
+    Args:
+        queries: The search query strings. (should be in persian alphabet)
+        top_poems: The number of poems to return
+        verses_per_poem: The number of matching beyts to return per poem
+        poet: Only search this poet's collections, e.g. "hafez" (null for all)
+        form: Only search this form, e.g. "ghazal" (null for all)
+
+    Returns:
+        A list of poems, best first, each a dictionary with:
+        - 'url': url to the poem.
+        - 'score': The best cosine similarity of the poem as a whole to the queries.
+        - 'verses': Its best beyts, as dictionaries with 'beyt' (beyt number), 'verse' and 'score';
+          a hit on half a beyt returns that hemistich as 'verse'.
+        The model receives them compacted by encode_poem_results:
+        {"base": poem url prefix, "poems": {poem_id: {"score": score, "beyts": [[beyt, score, verse], ...]}}}
+    """
+    # poem centroids live in sqlite-vec, whatever the verse search backend
+    index = get_sharded_index("sqlite") if index_instance is None else index_instance
+    filters = {key: value for key, value in (("poet", poet), ("form", form)) if value is not None}
+
+    if isinstance(queries, str):
+        queries = [queries]
+    queries = [query for query in queries if query and query.strip()]
+    logger.info(f"Executing poem search for queries: {queries} with top_poems={top_poems}")
+    if not queries:
+        logger.warning("Poem search query is empty.")
+        return []
+
+    with span("embed"):
+        query_embeddings = get_embeddings(queries)
+    if query_embeddings is None:
+        logger.error("Failed to generate embeddings for the queries.")
         return []
 
-    results = index.search(query_embedding, top_k=top_k)
-    logger.info(f"Found {len(results)} results for query '{query}'.")
+    with span("poem_knn"):
+        per_query = [
+            index.search_poems(query_vector, top_poems=top_poems, top_k=verses_per_poem, **filters)
+            for query_vector in query_embeddings
+        ]
+
+    # Merge per-query results: a poem keeps its best score and its best-scoring beyts across queries.
+    merged = {}
+    for poems in per_query:
+        for poem in poems:
+            entry = merged.setdefault(poem["url"], {**poem, "verses": {}})
+            entry["score"] = max(entry["score"], poem["score"])
+            for hit in poem["verses"]:
+                best = entry["verses"].get(hit["beyt"])
+                if best is None or hit["score"] > best["score"]:
+                    entry["verses"][hit["beyt"]] = hit
+    results = sorted(merged.values(), key=lambda poem: poem["score"], reverse=True)[:top_poems]
+    for poem in results:
+        poem["verses"] = sorted(poem["verses"].values(), key=lambda hit: hit["score"], reverse=True)[
+            :verses_per_poem
+        ]
+    logger.info(f"Found {len(results)} poems for queries {queries}.")
     return results
+
+
+poem_search_tool.output_encoder = encode_poem_results